@@ -24,6 +24,7 @@ int smooth_idx = 0;
 // --- Global Variable for Time Signature ---
 int TIME_SIGNATURE = 4; // Default to 4/4. Can be changed via Serial command later.
 int next_expected_beat = 1;   
+int pending_signature = 0;    // NEXT_SIG: applied on the next downbeat (0 = none)
 
 // --- Beat Detection Variables ---
 unsigned long last_beat_time = 0;
@@ -38,6 +39,7 @@ unsigned long last_print_time = 0;
 
 // Timing
 unsigned long last_loop_time = 0;
+unsigned long sample_us = 0; // micros() of the current IMU sample, sent with DATA / BEAT_TRIG for host clock sync
 
 // --- Prototypes ---
 void writeRegister(int csPin, byte reg, byte val, bool isAccel);
@@ -92,10 +94,26 @@ void loop() {
       if (new_sig >= 2 && new_sig <= 4) {
         TIME_SIGNATURE = new_sig;
         next_expected_beat = 1; // Reset beat counter
+        pending_signature = 0;
         Serial.print("Time: ");  Serial.println(TIME_SIGNATURE);
 
       }
     }
+    // Protocol: "NEXT_SIG:3" - mid-song meter change. The current bar finishes
+    // in the old meter; the new one starts with the next beat 1
+    else if (input.startsWith("NEXT_SIG:")) {
+      int new_sig = input.substring(9).toInt();
+      if (new_sig >= 2 && new_sig <= 4) {
+        if (next_expected_beat == 1) {
+          // Old bar already complete: the next beat is the new downbeat
+          TIME_SIGNATURE = new_sig;
+          pending_signature = 0;
+          Serial.print("Time: ");  Serial.println(TIME_SIGNATURE);
+        } else {
+          pending_signature = new_sig;
+        }
+      }
+    }
   }
   // 100Hz Loop
   unsigned long current_time = micros();
@@ -104,6 +122,7 @@ void loop() {
 
   float dt = 0.01f;
   last_loop_time = current_time;
+  sample_us = current_time;
 
   int16_t raw_ax, raw_ay, raw_az;
   int16_t raw_gx, raw_gy, raw_gz;
@@ -215,13 +234,15 @@ void loop() {
   // Small delay to make the plot readable
 
   //--- OUTPUT 1: Visualization Data (CSV) ---
-  //Format: DATA,x,y,z
+  //Format: DATA,x,y,z,sample_us
   Serial.print("DATA,");
   Serial.print(screen_x, 4); 
   Serial.print(",");
   Serial.print(screen_y, 4); 
   Serial.print(",");
-  Serial.println(screen_z, 4);
+  Serial.print(screen_z, 4);
+  Serial.print(",");
+  Serial.println(sample_us);
 
   // --- OUTPUT 2: Beat Detection Logic ---
   // Now passing both Position (screen_x/y/z) and Acceleration (b_ax/ay/az)
@@ -317,8 +338,15 @@ void detectBeat(float x, float y, float z, float ax, float ay, float az, float g
           // Serial.println("-----------------------------------");
 
           // --- NEW: Send Trigger to Python ---
-          Serial.println("BEAT_TRIG");
+          Serial.print("BEAT_TRIG,"); Serial.println(sample_us);
           Serial.print("BEAT: "); Serial.println(next_expected_beat - 1 == 0 ? TIME_SIGNATURE : next_expected_beat - 1);
+
+          // Meter change waiting for the downbeat: that was the old bar's last beat
+          if (pending_signature != 0 && next_expected_beat == 1) {
+              TIME_SIGNATURE = pending_signature;
+              pending_signature = 0;
+              Serial.print("Time: ");  Serial.println(TIME_SIGNATURE);
+          }
       }
   }
 }
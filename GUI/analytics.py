@@ -0,0 +1,161 @@
+import glob
+import io
+import os
+import threading
+import numpy as np
+import config
+
+# --- SESSION ANALYTICS ---
+# Stats over logs/track_rec_*.csv, computed with numpy and cached per file.
+# The cache key is (mtime, size). A recording that is still growing is not
+# re-parsed from the start: only the bytes appended since the last read are
+# loaded and concatenated onto the cached columns.
+
+TEMPO_CURVE_POINTS = 200    # tempo curve is downsampled to at most this many points
+ENVELOPE_WINDOW = 0.5       # seconds per gesture-envelope bin
+
+_cache = {}                 # path -> entry dict
+_cache_lock = threading.Lock()
+
+
+def list_sessions():
+    """ Recording file names, newest first """
+    paths = glob.glob(os.path.join(config.LOG_DIR, "track_rec_*.csv"))
+    paths.sort(key=os.path.getmtime, reverse=True)
+    return [os.path.basename(p) for p in paths]
+
+
+def _parse_rows(raw):
+    """ CSV bytes (complete lines only, no header) -> (N, 5+) float array """
+    if not raw.strip():
+        return np.zeros((0, 5))
+    return np.loadtxt(io.BytesIO(raw), delimiter=',', ndmin=2)
+
+
+def _load_columns(path, entry):
+    """ Reads new complete lines since entry['offset'] and appends them to entry['rows'] """
+    with open(path, 'rb') as f:
+        f.seek(entry["offset"])
+        raw = f.read()
+    if entry["offset"] == 0:
+        # Skip the header line
+        newline = raw.find(b'\n')
+        if newline < 0:
+            return
+        entry["offset"] = newline + 1
+        raw = raw[newline + 1:]
+    # Keep a half-written last line for the next read
+    end = raw.rfind(b'\n') + 1
+    if end == 0:
+        return
+    rows = _parse_rows(raw[:end])
+    entry["offset"] += end
+    if len(rows):
+        entry["rows"] = np.concatenate([entry["rows"], rows[:, :entry["rows"].shape[1]]]) if len(entry["rows"]) else rows
+
+
+def compute_stats(rows):
+    """
+    rows: Timestamp, X, Y, Z, bpm[, wand] -> JSON-ready dict.
+    Multi-wand recordings interleave the wands in arrival order, so every
+    wand is analysed on its own (same time origin, so the curves line up).
+    The headline numbers are the lowest wand ID's; "wands" has all of them.
+    """
+    if len(rows) == 0:
+        return {"samples": 0}
+    t0 = rows[:, 0].min()
+    if rows.shape[1] < 6:
+        return _wand_stats(rows, t0)
+    wand_ids = np.unique(rows[:, 5]).astype(int)
+    per_wand = {str(w): _wand_stats(rows[rows[:, 5] == w], t0) for w in wand_ids}
+    stats = dict(per_wand[str(wand_ids[0])])
+    stats["wand"] = int(wand_ids[0])
+    stats["wands"] = per_wand
+    return stats
+
+
+def _wand_stats(rows, t0):
+    """ One wand's rows (any order) -> stats, times in seconds since t0 """
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    t = rows[:, 0] - t0
+    xyz = rows[:, 1:4]
+    bpm = rows[:, 4]
+
+    # Tempo curve: downsample by averaging equal-size chunks
+    n_points = min(TEMPO_CURVE_POINTS, len(t))
+    edges = np.linspace(0, len(t), n_points + 1).astype(int)
+    counts = np.diff(edges)
+    curve_t = np.add.reduceat(t, edges[:-1]) / counts
+    curve_bpm = np.add.reduceat(bpm, edges[:-1]) / counts
+
+    # Beat period of the conducted tempo (60 / bpm), one value per 100 Hz
+    # sample - weighted by time, not per beat. The recording has no beat
+    # timestamps, so these are not measured beat-to-beat intervals.
+    playing = bpm > 0
+    periods = 60.0 / bpm[playing]
+    if len(periods):
+        period_stats = {
+            "mean": float(periods.mean()),
+            "std": float(periods.std()),
+            "min": float(periods.min()),
+            "max": float(periods.max()),
+            "p10": float(np.percentile(periods, 10)),
+            "p50": float(np.percentile(periods, 50)),
+            "p90": float(np.percentile(periods, 90)),
+        }
+        mean_bpm = float(bpm[playing].mean())
+        cv = float(bpm[playing].std() / mean_bpm) if mean_bpm > 0 else 0.0
+        # Stability: 1 = rock steady, 0 = tempo swings as large as the tempo itself
+        stability = max(0.0, 1.0 - cv)
+        # Tempo drift per minute (least squares slope of bpm over time)
+        drift = float(np.polyfit(t[playing], bpm[playing], 1)[0] * 60.0) if playing.sum() > 1 else 0.0
+    else:
+        period_stats, mean_bpm, stability, drift = {}, 0.0, 0.0, 0.0
+
+    # Gesture envelope: per-bin min / max / RMS of x, y, z
+    bins = ((t - t.min()) // ENVELOPE_WINDOW).astype(np.int64)
+    n_bins = int(bins[-1]) + 1
+    counts = np.bincount(bins, minlength=n_bins)
+    filled = counts > 0
+    env = {}
+    for axis, name in enumerate("xyz"):
+        col = xyz[:, axis]
+        lo = np.full(n_bins, np.inf)
+        hi = np.full(n_bins, -np.inf)
+        np.minimum.at(lo, bins, col)
+        np.maximum.at(hi, bins, col)
+        rms = np.sqrt(np.bincount(bins, weights=col * col, minlength=n_bins)[filled] / counts[filled])
+        env[name] = {"min": lo[filled].tolist(), "max": hi[filled].tolist(), "rms": rms.tolist()}
+    env["t"] = (t.min() + np.nonzero(filled)[0] * ENVELOPE_WINDOW).tolist()
+
+    return {
+        "samples": int(len(rows)),
+        "duration": float(t[-1] - t[0]),
+        "mean_bpm": mean_bpm,
+        "paused_fraction": float(1.0 - playing.mean()),
+        "tempo_stability": stability,
+        "tempo_drift_per_min": drift,
+        "tempo_period": period_stats,
+        "tempo_curve": {"t": curve_t.tolist(), "bpm": curve_bpm.tolist()},
+        "gesture_envelope": env,
+    }
+
+
+def session_stats(name):
+    """ Cached stats for one recording (raises FileNotFoundError for unknown names) """
+    path = os.path.join(config.LOG_DIR, os.path.basename(name))
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry["key"] == key:
+            return entry["stats"]
+        # Same file that only grew -> incremental; anything else -> start over
+        if entry is None or st.st_size < entry["offset"]:
+            entry = {"offset": 0, "rows": np.zeros((0, 5)), "key": None, "stats": None}
+        _load_columns(path, entry)
+        entry["stats"] = compute_stats(entry["rows"])
+        entry["key"] = key
+        _cache[path] = entry
+        return entry["stats"]
@@ -6,18 +6,39 @@ import time
 import mido
 import atexit
 from mido import tempo2bpm
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 import socket
 import csv
 import config
+import metrics
+import ringbuffer
+import timeline
+import library
+import analytics
 
 # --- IMPORT YOUR LISTENER MODULE ---
 import listener 
 
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
+
 
 
 app = Flask(__name__)
 
+# --- METRICS ---
+app_packets_received = metrics.counter("app_packets_received_total", "UDP packets handled by the music listener, by packet type")
+delivery_latency = metrics.histogram("app_delivery_latency_seconds", "Hub serial read -> picked up by the music listener, by packet type")
+midi_messages_sent = metrics.counter("midi_messages_sent_total", "MIDI messages sent to the output port")
+scheduler_lateness = metrics.histogram("midi_scheduler_lateness_seconds", "How late each MIDI message left vs. its scheduled time")
+replay_lag = metrics.histogram("replay_lag_seconds", "How far behind schedule each replayed CSV row was emitted")
+vis_switch_time = metrics.histogram("visualizer_switch_seconds", "Round trip of an ACTIVATE / DEACTIVATE to the warm visualizer, by mode")
+vis_startup_time = metrics.gauge("visualizer_startup_seconds", "Cold start of the visualizer process until it is ready (what every toggle used to cost)")
+hold_time = metrics.histogram("playback_hold_seconds", "How long playback held for a lost wand before resuming",
+                              buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 120.0))
+
 # --- GLOBAL STATE ---
 playback_state = {
     "bpm": 120.0,
@@ -25,6 +46,7 @@ playback_state = {
     "is_paused": False,
     "wand_enabled": False, 
     "filename": None,
+    "timeline": None,     # timeline.Timeline for the current song (may still be compiling)
     "thread": None,
     "current_ticks": 0,
     "total_ticks": 0,
@@ -38,29 +60,122 @@ playback_state = {
     "replay_active": False,
     "wand_connected": False,
     "last_wand_update": 0,
-    "last_beat_received": 0
+    "last_beat_received": 0,
+    "on_hold": False,     # Wand link lost mid-song: position + held notes kept until it is back
+    # --- MULTI-WAND ---
+    # The flat wand_* / bpm fields above always follow the tempo source wand.
+    "wands": {},            # wand ID -> {"bpm", "connected", "last_update", "last_beat"}
+    "tempo_source": 0,      # wand ID that drives the global BPM + warmup
+    "channel_groups": []    # optional [{"channels": [0, 1], "wand": 1}, ...] - per-group tempo
 }
 
-# --- GUI PROCESS KEEPER ---
+# Route handlers run on several server threads at once. Every multi-field
+# transition (start / stop / mode switches / BPM) happens under this lock.
+# The playback engine and /progress only read, and never wait on it.
+state_lock = threading.RLock()
+
+# --- VISUALIZER SERVICE (trace.py: started once, toggled over UDP) ---
 gui_process = None
+gui_active = False
 is_cleaning_up = False
 
+# --- HUB PROCESS ---
+hub_rings = {}  # ring name -> SampleRing (one per consumer, see config.HUB_ROUTES)
+hub_stop = threading.Event()
+hub_cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
 # --- HELPER: MANAGE GUI WINDOW ---
-def open_gui():
-    """ Opens the Visualization Window if not already open """
+def start_visualizer(active=False):
+    """ Starts the trace.py service unless it is already running. Returns True if it had to spawn """
     global gui_process
-    if gui_process is None:
-        print("--- APP: Launching GUI Window (trace.py)... ---")
+    with state_lock:
+        if gui_process is not None and gui_process.poll() is None:
+            return False
+        print("--- APP: Starting Visualizer Service (trace.py)... ---")
         # Ensure 'trace.py' is in the same directory
-        gui_process = subprocess.Popen([sys.executable, 'trace.py'])
+        args = [sys.executable, 'trace.py'] + (['--active'] if active else [])
+        gui_process = subprocess.Popen(args)
+        return True
 
-def close_gui():
-    """ Closes the Visualization Window if open """
+def stop_visualizer():
     global gui_process
-    if gui_process:
-        print("--- APP: Closing GUI Window... ---")
-        gui_process.terminate()
-        gui_process = None
+    with state_lock:
+        if gui_process:
+            gui_process.terminate()
+            gui_process = None
+
+def send_vis_command(cmd, timeout=config.VIS_ACK_TIMEOUT):
+    """
+    Sends VIS:<cmd> to the visualizer service and waits for its ACK.
+    Returns (round trip seconds, ready flag), or (None, False) without an answer.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind((config.IP, 0))
+        deadline = time.perf_counter() + timeout
+        started = time.perf_counter()
+        while time.perf_counter() < deadline:
+            sock.sendto(f"VIS:{cmd}".encode('utf-8'), (config.IP, config.PORT_VIS_CMD))
+            sock.settimeout(min(0.05, max(0.001, deadline - time.perf_counter())))
+            try:
+                reply = sock.recv(256).decode('utf-8').split()
+            except OSError:
+                time.sleep(0.01)
+                continue  # not bound yet / lost: ask again
+            if reply[:2] == ["VIS:ACK", cmd]:
+                return time.perf_counter() - started, reply[2:] == ["1"]
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    return None, False
+
+def measure_visualizer_startup(spawned_at, timeout=30.0):
+    """ Pings a freshly spawned service until it reports ready; that is the cost a toggle used to pay """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        rtt, ready = send_vis_command("PING")
+        if ready:
+            vis_startup_time.set(time.perf_counter() - spawned_at)
+            print(f"--- APP: Visualizer warm after {(time.perf_counter() - spawned_at) * 1000:.0f} ms ---")
+            return
+        time.sleep(0.05)
+
+def open_gui():
+    """
+    Switches the visualizer to streaming (it stays running between toggles).
+    The lock only covers the state flip; the UDP round trip happens outside,
+    so apply_bpm_logic never waits on the visualizer's ACK.
+    """
+    global gui_active
+    with state_lock:
+        spawned = start_visualizer(active=True)
+        if spawned or gui_active:
+            gui_active = True
+            return
+        gui_active = True
+    rtt, _ = send_vis_command("ACTIVATE")
+    if rtt is None:
+        with state_lock:
+            gui_active = False
+        return
+    vis_switch_time.observe(rtt, mode="activate")
+    print(f"--- APP: Visualizer active ({rtt * 1000:.2f} ms) ---")
+
+def close_gui():
+    """ Puts the visualizer to idle: the browser keeps its WebSocket, nothing is streamed """
+    global gui_active
+    with state_lock:
+        if not gui_active:
+            return
+        gui_active = False
+        proc = gui_process
+    if proc is None or proc.poll() is not None:
+        return  # service is gone: nothing to idle, don't wait out the ACK timeout
+    rtt, _ = send_vis_command("DEACTIVATE")
+    if rtt is not None:
+        vis_switch_time.observe(rtt, mode="deactivate")
+        print(f"--- APP: Visualizer idle ({rtt * 1000:.2f} ms) ---")
 
 def cleanup():
     """ Kills the GUI and stops all playback immediately """
@@ -84,115 +199,198 @@ def cleanup():
     except:
         pass
 
-    # 3. Kill the Visualizer Window
-    close_gui()
+    # 3. Kill the Visualizer Service
+    stop_visualizer()
 
-atexit.register(cleanup)
+    # 4. Stop the hub process (the supervisor terminates it) and free the rings
+    hub_stop.set()
+    if hub_rings:
+        time.sleep(0.6)
+        for ring in hub_rings.values():
+            ring.close()
 
-# --- UDP LISTENER ---
-def udp_music_listener():
-    print("--- APP: UDP Music Listener Started on Port 5005 ---")
-    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_sock.bind(("127.0.0.1", 5005)) 
-    udp_sock.setblocking(False)
-    
-    while True:
-        try:
-            data, addr = udp_sock.recvfrom(1024)
-            line = data.decode('utf-8').strip()
+# --- HUB LISTENER (shared-memory ring, written by the hub process) ---
+def wand_entry(wand_id):
+    """ Per-wand state, created the first time a wand reports in """
+    wands = playback_state["wands"]
+    if wand_id not in wands:
+        wands[wand_id] = {"bpm": 0.0, "connected": False, "last_update": 0, "last_beat": 0}
+    return wands[wand_id]
+
+def handle_hub_record(kind, val, text, wand_id=0):
+    """ Applies one hub record to the per-wand state (and to playback_state for the tempo source) """
+    wand = wand_entry(wand_id)
+    is_source = wand_id == playback_state["tempo_source"]
+
+    # --- 1. WARMUP LOGIC ---
+    if kind == ringbuffer.KIND_BEAT_TRIG and playback_state["in_warmup"] and is_source:
+        playback_state["warmup_count"] += 1
+        print(f"--- WARMUP: {playback_state['warmup_count']} / {playback_state['warmup_target']} ---")
+
+        # If we reached the target (e.g., 4 beats), start the music!
+        if playback_state["warmup_count"] >= playback_state["warmup_target"]:
+            print("--- WARMUP COMPLETE! STARTING MUSIC ---")
+            playback_state["in_warmup"] = False
+            # The playback_engine thread is waiting for this flag to flip
+
+    # Handle Connection Status
+    elif kind == ringbuffer.KIND_STATUS:
+        if text == b"CONNECTED":
+            wand["connected"] = True
+            wand["last_update"] = time.time()
+        elif text == b"DISCONNECTED":
+            wand["connected"] = False
+
+    elif kind == ringbuffer.KIND_BPM:
+        wand["connected"] = True
+        wand["last_update"] = time.time()
+        wand["bpm"] = timeline.clamp_bpm(float(val[0]))
+        if is_source and playback_state["wand_enabled"]:
+            apply_bpm_logic(float(val[0]))
+
+    elif kind == ringbuffer.KIND_BEAT:
+        # Update the global state so the frontend can see it
+        wand["last_beat"] = int(val[0])
+
+    elif kind == ringbuffer.KIND_TIME and playback_state["wand_enabled"]:
+        metrics.log_event("app", "time_signature_update", value=float(val[0]), wand=wand_id)
+
+    if is_source:
+        playback_state["wand_connected"] = wand["connected"]
+        playback_state["last_wand_update"] = wand["last_update"]
+        playback_state["last_beat_received"] = wand["last_beat"]
+
+def consume_hub_views(views):
+    """ One RingReader.poll() worth of records -> app state (the app ring only carries control records) """
+    now = time.time()
+    for view in views:
+        for rec in view:
+            kind = int(rec['kind'])
+            ptype = ringbuffer.KIND_NAMES.get(kind, "OTHER")
+            app_packets_received.inc(type=ptype)
+            delivery_latency.observe(now - float(rec['rx']), type=ptype)
             if playback_state["replay_active"]:
                 continue
+            handle_hub_record(kind, rec['val'], rec['text'], int(rec['wand']))
 
-            # --- 1. WARMUP LOGIC ---            
-            if line == "BEAT_TRIG" and playback_state["in_warmup"]:
-                playback_state["warmup_count"] += 1
-                print(f"--- WARMUP: {playback_state['warmup_count']} / {playback_state['warmup_target']} ---")
-                
-                # If we reached the target (e.g., 4 beats), start the music!
-                if playback_state["warmup_count"] >= playback_state["warmup_target"]:
-                    print("--- WARMUP COMPLETE! STARTING MUSIC ---")
-                    playback_state["in_warmup"] = False
-                    # The playback_engine thread is waiting for this flag to flip
-            
-            # Handle Connection Status
-            if line == "STATUS: CONNECTED":
-                playback_state["wand_connected"] = True
-                playback_state["last_wand_update"] = time.time()
-                continue
-            if line == "STATUS: DISCONNECTED":
-                playback_state["wand_connected"] = False
-                continue
+def hub_music_listener(ring):
+    print("--- APP: Hub Music Listener attached to shared-memory ring ---")
+    reader = ringbuffer.RingReader(ring)
 
-            if line.startswith("BPM: "):
-                playback_state["wand_connected"] = True
-                playback_state["last_wand_update"] = time.time()
-                if playback_state["wand_enabled"]:
-                    try:
-                        raw_val = float(line.split(":")[1].strip())
-                        apply_bpm_logic(raw_val)
-                    except ValueError:
-                        pass
-            if line.startswith("BEAT:"):
-                try:
-                    beat_val = int(line.split(":")[1].strip())
-                    # Update the global state so the frontend can see it
-                    playback_state["last_beat_received"] = beat_val
-                    #print(f"BEAT! Got beat: {beat_val}")
-                except ValueError:
-                    pass
-            elif line.startswith("Time: ") and playback_state["wand_enabled"]:
-                try:
-                    raw_val = float(line.split(":")[1].strip())
-                    print(f"-> Received Time Signature Update: {raw_val}")
-                except ValueError:
-                    pass
-
-                    
-        except BlockingIOError:
-            time.sleep(0.01)
+    while True:
+        try:
+            views = reader.poll()
+            if not views:
+                time.sleep(0.002)
+                continue
+            consume_hub_views(views)
         except Exception as e:
-            print(f"UDP Error: {e}")
+            metrics.log_event("app", "hub_listener_error", error=e)
             time.sleep(0.1)
 
+def send_hub_command(cmd):
+    """ Fire-and-forget command to the hub (forwarded to the wand unless prefixed HUB:) """
+    hub_cmd_sock.sendto(cmd.encode('utf-8'), (config.IP, config.PORT_CMD))
+
+def hub_state_sync():
+    """ Mirrors the flags the hub needs (recording edges, replay mode) into the hub process """
+    last_sent = None
+    last_sent_time = 0
+    while True:
+        state = (
+            int(playback_state["is_playing"] and playback_state["wand_enabled"]),
+            int(bool(playback_state["record_enabled"])),
+            int(bool(playback_state["replay_active"])),
+        )
+        # Resend every second too, so a freshly restarted hub catches up
+        if state != last_sent or time.time() - last_sent_time > 1.0:
+            try:
+                send_hub_command("HUB:STATE %d %d %d" % state)
+                last_sent = state
+                last_sent_time = time.time()
+            except OSError:
+                pass
+        time.sleep(0.02)
+
+def fetch_hub_metrics():
+    """ Asks the hub process for its metrics text (empty string if it does not answer) """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.2)
+    try:
+        sock.bind((config.IP, 0))
+        sock.sendto(b"HUB:METRICS", (config.IP, config.PORT_CMD))
+        data, _ = sock.recvfrom(65535)
+        return data.decode('utf-8')
+    except OSError:
+        return ""
+    finally:
+        sock.close()
+
 
 os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+library.init()
 
 # --- HELPER: CENTRALIZED BPM LOGIC ---
 def apply_bpm_logic(raw_bpm):
     global playback_state
-    if raw_bpm > 240: raw_bpm = 240.0
-    if raw_bpm < 0: raw_bpm = 0.0
+    raw_bpm = timeline.clamp_bpm(raw_bpm)
     
-    if raw_bpm == 0:
-        playback_state["is_paused"] = True
-    elif playback_state["bpm"] == 0 and raw_bpm > 0:
-        playback_state["is_paused"] = False
-        
-    playback_state["bpm"] = raw_bpm
+    with state_lock:
+        if raw_bpm == 0:
+            playback_state["is_paused"] = True
+        elif playback_state["bpm"] == 0 and raw_bpm > 0:
+            playback_state["is_paused"] = False
+            
+        playback_state["bpm"] = raw_bpm
     return raw_bpm
 
 # --- REPLAY DRIVER ---
+def load_replay_rows(csv_path, wand=None):
+    """
+    Recording rows (Timestamp, X, Y, Z, bpm[, wand]) as string lists.
+    Multi-wand recordings interleave every wand's rows; with `wand` set only
+    that wand's are kept (single-wand rows without the column always pass).
+    If the wand is not in the recording, the first wand recorded is used.
+    """
+    rows = []
+    with open(csv_path, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            if len(row) >= 5: 
+                rows.append(row)
+    if wand is None or not rows or len(rows[0]) < 6:
+        return rows
+    picked = [row for row in rows if row[5] == str(wand)]
+    if not picked:
+        print(f"--- REPLAY: wand {wand} not in recording, using wand {rows[0][5]} ---")
+        picked = [row for row in rows if row[5] == rows[0][5]]
+    return picked
+
+def replay_row(row_data):
+    """ One recorded row goes live: BPM logic + visual sample through the hub """
+    try:
+        csv_bpm = float(row_data[4])
+        apply_bpm_logic(csv_bpm)
+    except: pass
+
+    # Send Visual Data (the hub publishes it into the ring for trace.py)
+    send_hub_command(f"HUB:INJECT DATA,{row_data[1]},{row_data[2]},{row_data[3]}")
+
 def replay_driver(csv_path):
     """ Reads CSV and simulates live events for Visuals and BPM """
     print(f"--- REPLAY: Starting driver for {csv_path} ---")
     
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    
     try:
-        rows = []
-        with open(csv_path, 'r') as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            for row in reader:
-                if len(row) >= 5: 
-                    rows.append(row)
+        rows = load_replay_rows(csv_path, playback_state["tempo_source"])
         
         if not rows: 
             close_gui() # Close if file empty
             return
 
         start_t = float(rows[0][0]) 
-        system_start_time = time.time()
+        # Row timestamps are de-jittered device time; pace them on the monotonic clock
+        system_start_time = time.perf_counter()
 
         row_idx = 0
         total_rows = len(rows)
@@ -200,21 +398,12 @@ def replay_driver(csv_path):
         while playback_state["is_playing"] and row_idx < total_rows:
             while playback_state["is_paused"] and playback_state["is_playing"]:
                 time.sleep(0.05)
-            elapsed = time.time() - system_start_time
+            elapsed = time.perf_counter() - system_start_time
             row_t = float(rows[row_idx][0]) - start_t
             
             if elapsed >= row_t:
-                row_data = rows[row_idx]
-                
-                try:
-                    csv_bpm = float(row_data[4])
-                    apply_bpm_logic(csv_bpm)
-                except: pass
-
-                # Send Visual Data
-                sensor_str = f"DATA,{row_data[1]},{row_data[2]},{row_data[3]}"
-                sock.sendto(sensor_str.encode('utf-8'), (config.IP, config.PORT_VIS))
-                
+                replay_lag.observe(elapsed - row_t)
+                replay_row(rows[row_idx])
                 row_idx += 1
             else:
                 time.sleep(0.001)
@@ -233,52 +422,232 @@ def replay_driver(csv_path):
     close_gui() 
 
 # --- PLAYBACK ENGINE ---
+def split_channel_groups(messages, groups):
+    """
+    Splits a merged (delta-time) message stream by channel group.
+    Returns [(wand_id, channels, messages), ...]. The first entry is the main
+    stream (meta events + ungrouped channels, wand_id None = global BPM).
+    """
+    grouped = {}
+    for g in groups:
+        for ch in g["channels"]:
+            grouped[ch] = g["wand"]
+    wand_ids = list(dict.fromkeys(g["wand"] for g in groups))
+
+    main_channels = [ch for ch in range(16) if ch not in grouped]
+    streams = [(None, main_channels, [])] + [
+        (w, [ch for ch, gw in grouped.items() if gw == w], []) for w in wand_ids
+    ]
+    index = {w: i + 1 for i, w in enumerate(wand_ids)}
+    last_tick = [0] * len(streams)
+
+    abs_tick = 0
+    for msg in messages:
+        abs_tick += msg.time
+        target = 0
+        if not msg.is_meta and hasattr(msg, 'channel') and msg.channel in grouped:
+            target = index[grouped[msg.channel]]
+        streams[target][2].append(msg.copy(time=abs_tick - last_tick[target]))
+        last_tick[target] = abs_tick
+    return streams
+
+def stream_bpm(wand_id):
+    """ Live BPM for a stream: the global one, or a specific wand's in Wand Mode """
+    if wand_id is None or not playback_state["wand_enabled"]:
+        return playback_state["bpm"]
+    return playback_state["wands"].get(wand_id, {}).get("bpm", 0.0)
+
+def wand_lost(wand_id):
+    """ True when the wand driving this stream has dropped its link (Wand Mode only) """
+    if not playback_state["wand_enabled"]:
+        return False
+    if wand_id is None:
+        return not playback_state["wand_connected"]
+    return not playback_state["wands"].get(wand_id, {}).get("connected", False)
+
+def track_sounding(msg, held, sustain):
+    """ Keeps the notes / sustain pedals this stream currently has down """
+    if msg.type == 'note_on' and msg.velocity > 0:
+        held[(msg.channel, msg.note)] = msg.velocity
+    elif msg.type in ('note_off', 'note_on'):
+        held.pop((msg.channel, msg.note), None)
+    elif msg.type == 'control_change' and msg.control == 64:
+        sustain[msg.channel] = msg.value
+
+def hold_for_wand(port, port_lock, wand_id, held, sustain):
+    """
+    Wand link lost: silence the stream but keep its song position and the
+    notes it was holding. When the wand is back the held notes are struck
+    again and playback continues. Gives up (stops the song) after
+    config.WAND_HOLD_TIMEOUT seconds.
+    """
+    is_main = wand_id is None
+    if is_main:
+        playback_state["on_hold"] = True
+    started = time.time()
+    print(f"--- ENGINE: Wand lost, holding at tick {playback_state['current_ticks']} ---")
+    with port_lock:
+        for (ch, note) in held:
+            port.send(mido.Message('note_off', channel=ch, note=note, velocity=0))
+        for ch, value in sustain.items():
+            if value >= 64:
+                port.send(mido.Message('control_change', channel=ch, control=64, value=0))
+
+    while wand_lost(wand_id) and playback_state["is_playing"]:
+        if config.WAND_HOLD_TIMEOUT and time.time() - started > config.WAND_HOLD_TIMEOUT:
+            print("--- ENGINE: Wand did not come back, stopping ---")
+            playback_state["is_playing"] = False
+            break
+        time.sleep(0.005)
+
+    if is_main:
+        playback_state["on_hold"] = False
+    if not playback_state["is_playing"]:
+        return
+    hold_time.observe(time.time() - started)
+    print(f"--- ENGINE: Wand back after {(time.time() - started) * 1000:.0f} ms, resuming ---")
+    with port_lock:
+        for ch, value in sustain.items():
+            if value >= 64:
+                port.send(mido.Message('control_change', channel=ch, control=64, value=value))
+        for (ch, note), velocity in held.items():
+            port.send(mido.Message('note_on', channel=ch, note=note, velocity=velocity))
+
+def wand_beats_per_bar(numerator, denominator):
+    """
+    Beat pattern the wand conducts a meter in - the firmware knows 2, 3 and 4.
+    Compound meters (6/8, 9/8, 12/8) are conducted in 2 / 3 / 4. None = no pattern (5/4, 7/8...)
+    """
+    if denominator >= 8 and numerator > 3 and numerator % 3 == 0:
+        numerator //= 3
+    return numerator if 2 <= numerator <= 4 else None
+
+def send_meter_change(numerator, denominator):
+    """ Mid-song meter change: new beat count for the app, and for the wand(s) in Wand Mode """
+    playback_state["weight"] = numerator
+    if not playback_state["wand_enabled"]:
+        return
+    beats = wand_beats_per_bar(numerator, denominator)
+    if beats is None:
+        metrics.log_event("app", "meter_not_conductable", meter=f"{numerator}/{denominator}")
+        return
+    try:
+        # NEXT_SIG (not SET_SIG): the wand finishes the current bar in the old meter
+        send_hub_command(f"NEXT_SIG:{beats}")
+        print(f"--- APP: Meter -> {numerator}/{denominator}, sent NEXT_SIG:{beats} ---")
+    except OSError as e:
+        print(f"--- APP: Failed to send weight: {e} ---")
+
+def meter_lead_ticks(tl, change_tick):
+    """ How far ahead of a meter change NEXT_SIG goes out: SIG_LEAD_BEATS beats of the meter it ends """
+    denominator = tl.bar_beat_at(change_tick - 1)[3]
+    return config.SIG_LEAD_BEATS * tl.ticks_per_beat * 4 / denominator
+
+def play_stream(messages, ticks_per_beat, port, port_lock, wand_id=None, channels=range(16), tl=None):
+    """
+    Plays one delta-time stream. Only the main stream (wand_id None) moves
+    current_ticks, and - given the timeline - announces meter changes.
+    """
+    is_main = wand_id is None
+    held = {}       # (channel, note) -> velocity, for hold / resume
+    sustain = {}    # channel -> CC64 value
+    meter_cue = None    # next meter change to announce: (abs_tick, numerator, denominator)
+    known_meters = 0    # bar map size when meter_cue was looked up (it grows while compiling)
+    if not is_main: tl = None
+    for msg in messages:
+        if not playback_state["is_playing"]: break
+        if wand_lost(wand_id):
+            hold_for_wand(port, port_lock, wand_id, held, sustain)
+
+        while (playback_state["is_paused"] or stream_bpm(wand_id) <= 0) and playback_state["is_playing"]:
+            with port_lock:
+                for ch in channels:
+                    try:
+                        # CC 123 = All Notes Off (stops ringing notes)
+                        port.send(mido.Message('control_change', channel=ch, control=123, value=0))
+                        # CC 64 = Sustain Pedal Off (lifts the pedal if it was down)
+                        port.send(mido.Message('control_change', channel=ch, control=64, value=0))
+                    except:
+                        pass
+            held.clear()
+            sustain.clear()
+            if wand_lost(wand_id):
+                hold_for_wand(port, port_lock, wand_id, held, sustain)
+            time.sleep(0.05) 
+        if not playback_state["is_playing"]: break
+
+        if msg.time > 0:
+            if is_main:
+                tick_before = playback_state["current_ticks"]
+                playback_state["current_ticks"] += msg.time
+            current_bpm = stream_bpm(wand_id)
+            if current_bpm <= 0: current_bpm = 120 
+            
+            seconds_per_beat = 60.0 / current_bpm
+            seconds_per_tick = seconds_per_beat / ticks_per_beat
+            sleep_time = msg.time * seconds_per_tick
+            due = time.perf_counter() + sleep_time
+
+            if tl is not None:
+                if meter_cue is None and len(tl.sig_ticks) != known_meters:
+                    known_meters = len(tl.sig_ticks)
+                    meter_cue = tl.next_meter_change(tick_before)
+                # Meter change SIG_LEAD_BEATS ahead (inside the old meter's last bar): send NEXT_SIG
+                # at that exact point inside this wait
+                while meter_cue is not None:
+                    cue_tick = meter_cue[0] - meter_lead_ticks(tl, meter_cue[0])
+                    if tick_before + msg.time < cue_tick:
+                        break
+                    cue_at = due - sleep_time + max(0.0, cue_tick - tick_before) * seconds_per_tick
+                    time.sleep(max(0.0, cue_at - time.perf_counter()))
+                    send_meter_change(meter_cue[1], meter_cue[2])
+                    meter_cue = tl.next_meter_change(meter_cue[0])
+
+            time.sleep(max(0.0, due - time.perf_counter()))
+            scheduler_lateness.observe(max(0.0, time.perf_counter() - due))
+        if msg.type == 'set_tempo':
+            # Only apply auto-tempo if we are NOT in Wand Mode and NOT in Replay Mode
+            # (In those modes, the Wand or the CSV should dictate the speed)
+            if not playback_state["wand_enabled"] and not playback_state["replay_active"]:
+                new_bpm = tempo2bpm(msg.tempo)
+                playback_state["bpm"] = new_bpm
+                metrics.log_event("engine", "auto_bpm", bpm=f"{new_bpm:.1f}")
+
+        if not msg.is_meta:
+            with port_lock:
+                port.send(msg)
+            midi_messages_sent.inc()
+            track_sounding(msg, held, sustain)
+
 def playback_engine():
     global playback_state
     try:
         if not playback_state["filename"]: return
 
-        mid = mido.MidiFile(playback_state["filename"])
-        playback_state["total_ticks"] = max(sum(msg.time for msg in track) for track in mid.tracks)
-        playback_state["original_duration"] = mid.length
+        # The route already started compiling; the timeline may still be growing
+        tl = playback_state["timeline"]
+        if tl is None:
+            tl = timeline.compile_streaming(playback_state["filename"])
+            playback_state["timeline"] = tl
         playback_state["current_ticks"] = 0
-        messages = mido.merge_tracks(mid.tracks)
+        groups = playback_state["channel_groups"] if playback_state["wand_enabled"] else []
         
         with mido.open_output() as port:
-            for msg in messages:
-                if not playback_state["is_playing"]: break
-                if playback_state["is_playing"] and playback_state["wand_enabled"] and not playback_state["wand_connected"]: break
-                
-                while (playback_state["is_paused"] or playback_state["bpm"] <= 0) and playback_state["is_playing"]:
-                    for ch in range(16):
-                        try:
-                            # CC 123 = All Notes Off (stops ringing notes)
-                            port.send(mido.Message('control_change', channel=ch, control=123, value=0))
-                            # CC 64 = Sustain Pedal Off (lifts the pedal if it was down)
-                            port.send(mido.Message('control_change', channel=ch, control=64, value=0))
-                        except:
-                            pass
-                    if playback_state["wand_enabled"] and not playback_state["wand_connected"]: break
-                    time.sleep(0.05) 
-
-                if msg.time > 0:
-                    playback_state["current_ticks"] += msg.time
-                    current_bpm = playback_state["bpm"]
-                    if current_bpm <= 0: current_bpm = 120 
-                    
-                    seconds_per_beat = 60.0 / current_bpm
-                    sleep_time = msg.time * (seconds_per_beat / mid.ticks_per_beat)
-                    time.sleep(sleep_time)
-                if msg.type == 'set_tempo':
-                    # Only apply auto-tempo if we are NOT in Wand Mode and NOT in Replay Mode
-                    # (In those modes, the Wand or the CSV should dictate the speed)
-                    if not playback_state["wand_enabled"] and not playback_state["replay_active"]:
-                        new_bpm = tempo2bpm(msg.tempo)
-                        playback_state["bpm"] = new_bpm
-                        print(f"--- AUTO-BPM: Tempo changed to {new_bpm:.1f} ---")
-
-                if not msg.is_meta:
-                    port.send(msg)
+            port_lock = threading.Lock()
+            if not groups:
+                play_stream(tl.iter_messages(), tl.ticks_per_beat, port, port_lock, tl=tl)
+            else:
+                # Splitting by channel needs the whole file
+                tl.wait_complete()
+                # One worker per wand-driven channel group, main stream on this thread
+                (_, main_channels, main_msgs), *group_streams = split_channel_groups(tl.messages, groups)
+                workers = [
+                    threading.Thread(target=play_stream, args=(msgs, tl.ticks_per_beat, port, port_lock, w_id, chans), daemon=True)
+                    for w_id, chans, msgs in group_streams
+                ]
+                for w in workers: w.start()
+                play_stream(main_msgs, tl.ticks_per_beat, port, port_lock, None, main_channels, tl)
+                for w in workers: w.join()
     except Exception as e:
         print(f"Playback Error: {e}")
     
@@ -286,30 +655,44 @@ def playback_engine():
     playback_state["is_paused"] = False
     playback_state["current_ticks"] = 0
     playback_state["in_warmup"] = False # Reset just in case 
+def iter_all_messages(source):
+    """ Every message of a mido.MidiFile (track by track) or of a plain message list """
+    if hasattr(source, 'tracks'):
+        for track in source.tracks:
+            yield from track
+    else:
+        yield from source
+
 def get_weight_count(mid_object):
     """
     Returns the numerator (number of beats) of the time signature.
     Defaults to 4 if no time_signature message is found.
     """
-    for track in mid_object.tracks:
-        for msg in track:
-            if msg.type == 'time_signature':
-                return msg.numerator
+    for msg in iter_all_messages(mid_object):
+        if msg.type == 'time_signature':
+            return msg.numerator
     return 4  # Standard MIDI default
 
-def extract_smart_metadata(mid_obj):
+def get_start_bpm(mid_object):
+    """ First set_tempo of the file as BPM (120 if there is none) """
+    for msg in iter_all_messages(mid_object):
+        if msg.type == 'set_tempo':
+            return tempo2bpm(msg.tempo)
+    return 120.0
+
+def split_smart_metadata(mid_obj):
     """
     Scans all tracks for track_name messages to find the best Title and Artist.
+    Returns (title, artist).
     """
     candidates = []
     
     # 1. Gather all unique, non-empty text names
-    for track in mid_obj.tracks:
-        for msg in track:
-            if msg.type == 'track_name':
-                text = msg.name.strip()
-                if text and text.lower() not in ['untitled', 'copyright', 'track']:
-                    candidates.append(text)
+    for msg in iter_all_messages(mid_obj):
+        if msg.type == 'track_name':
+            text = msg.name.strip()
+            if text and text.lower() not in ['untitled', 'copyright', 'track']:
+                candidates.append(text)
 
     # Remove duplicates while preserving order
     unique_candidates = []
@@ -335,7 +718,13 @@ def extract_smart_metadata(mid_obj):
         if len(text) > len(title) or title == "Unknown Track":
             title = text
 
-    # 3. Formatting
+    return title, artist
+
+def extract_smart_metadata(mid_obj):
+    """ Display name: "Title (Artist)" or just "Title" """
+    title, artist = split_smart_metadata(mid_obj)
+
+    # Formatting
     full_display = title
     if artist:
         full_display = f"{title} ({artist})"
@@ -351,15 +740,18 @@ def index():
 def set_record_mode():
     data = request.json
     enabled = data.get('enabled', False)
-    playback_state["record_enabled"] = enabled
+    with state_lock:
+        playback_state["record_enabled"] = enabled
     return jsonify({"status": "success", "enabled": enabled})
 
 @app.route('/set_wand_mode', methods=['POST'])
 def set_wand_mode():
     data = request.json
     enabled = data.get('enabled', False)
-    playback_state["wand_enabled"] = enabled
-    
+    with state_lock:
+        playback_state["wand_enabled"] = enabled
+
+    # Outside the lock: the toggle waits for the visualizer's ACK
     if enabled:
         # Wand Mode ON -> Open GUI
         open_gui()
@@ -382,21 +774,30 @@ def start_replay():
     midi_file.save(midi_path)
     csv_file.save(csv_path)
 
-    playback_state["filename"] = midi_path
-    playback_state["is_playing"] = True
-    playback_state["is_paused"] = False
-    playback_state["replay_active"] = True
-    playback_state["wand_enabled"] = False 
-    
-    # Start Playback Threads
-    playback_state["thread"] = threading.Thread(target=playback_engine)
-    playback_state["thread"].daemon = True
-    playback_state["thread"].start()
+    try:
+        tl = timeline.compile_streaming(midi_path)
+    except Exception as e:
+        print(f"Error loading MIDI: {e}")
+        return jsonify({"status": "error", "message": "Invalid MIDI file"}), 400
+
+    stop_engine()
+    with state_lock:
+        playback_state["filename"] = midi_path
+        playback_state["timeline"] = tl
+        playback_state["is_playing"] = True
+        playback_state["is_paused"] = False
+        playback_state["replay_active"] = True
+        playback_state["wand_enabled"] = False 
+        
+        # Start Playback Threads
+        playback_state["thread"] = threading.Thread(target=playback_engine)
+        playback_state["thread"].daemon = True
+        playback_state["thread"].start()
+
+        replay_t = threading.Thread(target=replay_driver, args=(csv_path,))
+        replay_t.daemon = True
+        replay_t.start()
 
-    replay_t = threading.Thread(target=replay_driver, args=(csv_path,))
-    replay_t.daemon = True
-    replay_t.start()
-    
     # REPLAY START -> Open GUI
     open_gui()
 
@@ -408,25 +809,75 @@ def upload_and_play():
     file = request.files['midiFile']
     
     is_wand_mode = request.form.get('wand_mode') == 'true'
-    playback_state["wand_enabled"] = is_wand_mode 
-    playback_state["replay_active"] = False
-    
     if file.filename == '': return jsonify({"status": "error"}), 400
 
-    filepath = os.path.join(config.UPLOAD_FOLDER, 'live_input.mid')
-    file.save(filepath)
+    # Keep every upload in the score library (same file uploaded twice = same entry)
+    try:
+        score_id, sha1, filepath = library.store_upload(file)
+    except ValueError as e:
+        print(f"Error loading MIDI: {e}")
+        return jsonify({"status": "error", "message": "Invalid MIDI file"}), 400
+    if score_id is not None:
+        return play_library_score(score_id, is_wand_mode)
 
-    # 1. Calculate Weight
+    # 1. Parse only the first bar; the rest of the file compiles in the background
+    pending = {}
+    def index_compiled(tl):
+        # Compile thread: wait until the route has created the row, then store the compiled data
+        pending["ready"].wait()
+        if "id" in pending:  # no row if the route failed
+            library.set_compiled(pending["id"], tl)
+    pending["ready"] = threading.Event()
     try:
-        mid_object = mido.MidiFile(filepath)
+        tl = timeline.compile_streaming(filepath, on_complete=index_compiled)
     except Exception as e:
         print(f"Error loading MIDI: {e}")
+        os.remove(filepath)  # new file, no library row points at it
         return jsonify({"status": "error", "message": "Invalid MIDI file"}), 400
-    
-    smart_name = extract_smart_metadata(mid_object)
 
-    # 2. Pass the OBJECT to get_weight_count (not the string)
-    detected_weight = get_weight_count(mid_object)
+    try:
+        # Title / meter / tempo events sit at the start of the tracks, so the first bar is enough
+        head = tl.first_events(tl.first_bar_ticks)
+        title, artist = split_smart_metadata(head)
+        smart_name = extract_smart_metadata(head)
+
+        # 2. Weight + tempo from the same first-bar messages
+        detected_weight = get_weight_count(head)
+        detected_bpm = get_start_bpm(head)
+
+        pending["id"] = library.add_score(sha1, file.filename, filepath, title, artist, detected_weight, detected_bpm)
+        library.cache_timeline(pending["id"], tl)
+    finally:
+        pending["ready"].set()  # never leave the compile thread waiting
+
+    result = start_song(filepath, tl, is_wand_mode, detected_weight, detected_bpm)
+    result.update({"track_name": smart_name, "score_id": pending["id"]})
+    return jsonify(result)
+
+def stop_engine():
+    """
+    Stops the playback engine and waits until its thread is gone, so its exit
+    (is_playing / current_ticks reset) can't land on the next song's state.
+    Call without state_lock: the engine finishes its current wait first.
+    """
+    with state_lock:
+        playback_state["is_playing"] = False
+        thread = playback_state["thread"]
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
+
+def start_song(filepath, tl, is_wand_mode, detected_weight, detected_bpm):
+    """ Shared by upload and library play: stop the old song, warmup, weight -> wand, engine start """
+    while True:
+        stop_engine()
+        with state_lock:
+            # Another request may have started a song while we waited for the old engine
+            if playback_state["thread"] is None or not playback_state["thread"].is_alive():
+                return _start_song(filepath, tl, is_wand_mode, detected_weight, detected_bpm)
+
+def _start_song(filepath, tl, is_wand_mode, detected_weight, detected_bpm):
+    playback_state["wand_enabled"] = is_wand_mode
+    playback_state["replay_active"] = False
     playback_state["weight"] = detected_weight
 
     # 2. Configure Warmup
@@ -437,70 +888,156 @@ def upload_and_play():
         
         # Send Weight to Arduino
         try:
-            udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             # Command format: "SET_SIG:3"
-            msg = f"SET_SIG:{detected_weight}"
-            udp_sock.sendto(msg.encode('utf-8'), ("127.0.0.1", config.PORT_CMD))
+            send_hub_command(f"SET_SIG:{detected_weight}")
             print(f"--- APP: Sent Weight {detected_weight} to Arduino ---")
         except Exception as e:
             print(f"--- APP: Failed to send weight: {e} ---")
-    
-    detected_bpm = 120.0
-    found_tempo = False
-    try:
-        temp_mid = mido.MidiFile(filepath)
-        for track in temp_mid.tracks:
-            for msg in track:
-                if msg.type == 'set_tempo':
-                    detected_bpm = tempo2bpm(msg.tempo)
-                    found_tempo = True  
-                    break
-            if found_tempo: break
-    except: pass
 
     start_bpm = 0.0 if is_wand_mode else detected_bpm
     
     playback_state["filename"] = filepath
+    playback_state["timeline"] = tl
     playback_state["is_playing"] = True
     playback_state["is_paused"] = not is_wand_mode
     playback_state["bpm"] = start_bpm
     
-    if playback_state["thread"] is None or not playback_state["thread"].is_alive():
-        playback_state["thread"] = threading.Thread(target=playback_engine)
-        playback_state["thread"].daemon = True
-        playback_state["thread"].start()
+    # The engine is stopped (start_song): the new timeline never meets the old song's position
+    playback_state["thread"] = threading.Thread(target=playback_engine)
+    playback_state["thread"].daemon = True
+    playback_state["thread"].start()
 
     # NOTE: We do not force open GUI here. 
     # Wand Mode toggle handles opening/closing. 
     # If we are in Wand Mode, GUI is already open.
     
-    return jsonify({"status": "success", "start_bpm": start_bpm, "track_name": smart_name, "detected_weight": detected_weight})
+    return {"status": "success", "start_bpm": start_bpm, "detected_weight": detected_weight}
+
+def play_library_score(score_id, is_wand_mode):
+    score = library.get_score(score_id)
+    if score is None:
+        return jsonify({"status": "error", "message": "Unknown score"}), 404
+
+    # Compiled timeline = no MIDI parsing at all; otherwise fall back to streaming
+    try:
+        # A recent play (or a compile still running) is reused from memory
+        tl = library.cached_timeline(score_id)
+        if tl is None and score["timeline_path"] and os.path.exists(score["timeline_path"]):
+            tl = library.load_timeline(score_id, score["timeline_path"])
+        elif tl is None:
+            tl = timeline.compile_streaming(score["midi_path"], on_complete=lambda t: library.set_compiled(score_id, t))
+            library.cache_timeline(score_id, tl)
+    except Exception as e:
+        print(f"Error loading MIDI: {e}")
+        return jsonify({"status": "error", "message": "Invalid MIDI file"}), 400
+
+    result = start_song(score["midi_path"], tl, is_wand_mode, score["weight"], score["start_bpm"])
+    display = f"{score['title']} ({score['artist']})" if score["artist"] else score["title"]
+    result.update({"track_name": display, "score_id": score_id})
+    return jsonify(result)
+
+# --- LIBRARY ROUTES ---
+@app.route('/library')
+def library_list():
+    return jsonify({"status": "success", "scores": library.list_scores()})
+
+@app.route('/library/search')
+def library_search():
+    return jsonify({"status": "success", "scores": library.search(request.args.get('q', ''))})
+
+@app.route('/library/<int:score_id>')
+def library_detail(score_id):
+    score = library.get_score(score_id)
+    if score is None:
+        return jsonify({"status": "error", "message": "Unknown score"}), 404
+    return jsonify({"status": "success", "score": score})
+
+@app.route('/library/<int:score_id>/play', methods=['POST'])
+def library_play(score_id):
+    data = request.get_json(silent=True) or request.form
+    is_wand_mode = str(data.get('wand_mode', 'false')).lower() == 'true'
+    return play_library_score(score_id, is_wand_mode)
 
 @app.route('/progress')
 def progress():
+    # While the song is still compiling, the timeline has the freshest totals
+    tl = playback_state["timeline"]
+    current_ticks = playback_state["current_ticks"]
     current_time_display = 0.0
-    if playback_state["total_ticks"] > 0:
-        percent = playback_state["current_ticks"] / playback_state["total_ticks"]
-        current_time_display = percent * playback_state["original_duration"]
+    remaining = remaining_live = None
+    bar = beat = 0
+    numerator, denominator = 4, 4
+    if tl is not None:
+        playback_state["total_ticks"] = tl.total_ticks
+        playback_state["original_duration"] = tl.duration
+        # Score time from the tempo index (exact across tempo changes)
+        current_time_display = tl.seconds_at(current_ticks)
+        remaining = max(0.0, tl.duration - current_time_display)
+        # Wall-clock projection at the live BPM. Wand / replay ignore the file's tempo map.
+        follow_map = not playback_state["wand_enabled"] and not playback_state["replay_active"]
+        remaining_live = tl.remaining_seconds(current_ticks, playback_state["bpm"], follow_map)
+        bar, beat, numerator, denominator = tl.bar_beat_at(current_ticks)
+    total_ticks = playback_state["total_ticks"]
     return jsonify({
-        "progress_percent": (playback_state["current_ticks"] / playback_state["total_ticks"]) * 100 if playback_state["total_ticks"] > 0 else 0,
+        "progress_percent": (current_ticks / total_ticks) * 100 if total_ticks > 0 else 0,
         "current_time_str": current_time_display,
         "total_time_str": playback_state["original_duration"],
+        "remaining_time": remaining,             # score time left (file tempo map)
+        "remaining_time_live": remaining_live,   # wall-clock time left at the current BPM (None while stopped)
+        "score_beat": current_ticks / tl.ticks_per_beat if tl is not None else 0.0,
+        "bar": bar + 1,                          # 1-based bar:beat from the bar map
+        "beat_in_bar": beat + 1,
+        "time_signature": f"{numerator}/{denominator}",
         "is_playing": playback_state["is_playing"],
+        "on_hold": playback_state["on_hold"],
         "current_bpm": playback_state["bpm"],
         "record_enabled": playback_state["record_enabled"],
         "replay_active": playback_state["replay_active"],
         "current_beat": playback_state.get("last_beat_received", 0)
     })
 
+# --- SESSION ANALYTICS ---
+def headline_stats(stats):
+    """ Session stats without the curves (and without the per-wand breakdown) """
+    return {k: v for k, v in stats.items() if k not in ("tempo_curve", "gesture_envelope", "wands")}
+
+@app.route('/analytics/sessions')
+def analytics_sessions():
+    """ Dashboard list: headline numbers for every recording (curves left out) """
+    sessions = []
+    for name in analytics.list_sessions():
+        try:
+            stats = analytics.session_stats(name)
+        except (OSError, ValueError) as e:
+            metrics.log_event("app", "analytics_error", file=name, error=e)
+            continue
+        summary = headline_stats(stats)
+        if "wands" in stats:
+            summary["wands"] = {w: headline_stats(s) for w, s in stats["wands"].items()}
+        summary["name"] = name
+        sessions.append(summary)
+    return jsonify({"status": "success", "sessions": sessions})
+
+@app.route('/analytics/sessions/<name>')
+def analytics_session(name):
+    try:
+        stats = analytics.session_stats(name)
+    except FileNotFoundError:
+        return jsonify({"status": "error", "message": "Unknown session"}), 404
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Unreadable session: {e}"}), 400
+    return jsonify({"status": "success", "name": name, "stats": stats})
+
 @app.route('/pause', methods=['POST'])
 def pause():
-    playback_state["is_paused"] = True
+    with state_lock:
+        playback_state["is_paused"] = True
     return jsonify({"status": "paused"})
 
 @app.route('/resume', methods=['POST'])
 def resume():
-    if playback_state["bpm"] > 0: playback_state["is_paused"] = False
+    with state_lock:
+        if playback_state["bpm"] > 0: playback_state["is_paused"] = False
     return jsonify({"status": "resumed"})
 
 @app.route('/set_bpm', methods=['POST'])
@@ -516,13 +1053,15 @@ def set_bpm():
 
 @app.route('/stop', methods=['POST'])
 def stop():
+    with state_lock:
+        was_replay = playback_state["replay_active"]
+        playback_state["is_playing"] = False
+        playback_state["is_paused"] = False
+        playback_state["replay_active"] = False
+
     # If we were in Replay Mode, we must close the GUI now
-    if playback_state["replay_active"]:
+    if was_replay:
         close_gui()
-
-    playback_state["is_playing"] = False
-    playback_state["is_paused"] = False
-    playback_state["replay_active"] = False
     
     # We do NOT close GUI if we are in Wand Mode (wand_enabled=True)
     # The user might want to load another song while in Wand Mode.
@@ -533,37 +1072,94 @@ def stop():
 def reset():
     playback_state["is_playing"] = False
     time.sleep(0.1)
-    playback_state["filename"] = None
-    playback_state["bpm"] = 120.0
-    playback_state["replay_active"] = False
-    playback_state["wand_enabled"] = False
+    with state_lock:
+        playback_state["is_playing"] = False
+        playback_state["filename"] = None
+        playback_state["timeline"] = None
+        playback_state["bpm"] = 120.0
+        playback_state["replay_active"] = False
+        playback_state["wand_enabled"] = False
     close_gui() # Reset kills everything
     return jsonify({"status": "reset_complete"})
 
 @app.route('/wand_status')
 def get_wand_status():
-    # If no heartbeat for 3 seconds, assume disconnected
-    if time.time() - playback_state["last_wand_update"] > 3.0:
+    # If no heartbeat for WAND_STATUS_TIMEOUT, assume disconnected (the hub reports drops much faster)
+    now = time.time()
+    for wand in list(playback_state["wands"].values()):
+        if now - wand["last_update"] > config.WAND_STATUS_TIMEOUT:
+            wand["connected"] = False
+    if now - playback_state["last_wand_update"] > config.WAND_STATUS_TIMEOUT:
         playback_state["wand_connected"] = False
         
     return jsonify({
         "connected": playback_state["wand_connected"],
-        "enabled": playback_state["wand_enabled"]
+        "enabled": playback_state["wand_enabled"],
+        "on_hold": playback_state["on_hold"],
+        "tempo_source": playback_state["tempo_source"],
+        "wands": {str(w_id): w for w_id, w in list(playback_state["wands"].items())}
     })
 
+@app.route('/set_tempo_source', methods=['POST'])
+def set_tempo_source():
+    """
+    Picks which wand drives the music. Body: {"wand": 1} and/or
+    {"groups": [{"channels": [0, 1, 2], "wand": 1}, ...]} - channels listed in a
+    group follow that wand's tempo, everything else follows "wand".
+    """
+    data = request.json or {}
+    try:
+        source = int(data["wand"]) if "wand" in data else None
+        groups = [
+            {"channels": [int(ch) for ch in g["channels"]], "wand": int(g["wand"])}
+            for g in data["groups"]
+        ] if "groups" in data else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"status": "error"}), 400
+    wand_ids = ([source] if source is not None else []) + [g["wand"] for g in groups or []]
+    unknown = [w for w in wand_ids if not 0 <= w < len(config.WAND_PORTS)]
+    if unknown:
+        return jsonify({"status": "error", "message": f"Unknown wand {unknown[0]}"}), 400
+    with state_lock:
+        if source is not None:
+            playback_state["tempo_source"] = source
+        if groups is not None:
+            playback_state["channel_groups"] = groups
+    return jsonify({"status": "success", "tempo_source": playback_state["tempo_source"],
+                    "groups": playback_state["channel_groups"]})
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render() + fetch_hub_metrics(), mimetype='text/plain; version=0.0.4')
+
 
 if __name__ == '__main__':
-    print("--- APP: Starting Internal Listener Thread... ---")
-    udp_thread = threading.Thread(target=udp_music_listener, daemon=True)
-    udp_thread.start()
-    t = threading.Thread(target=listener.listen, args=(playback_state,), daemon=True)
-    t.start()
+    atexit.register(cleanup)
+
+    # The app owns the rings; the hub process (and trace.py) attach to them by name
+    hub_rings[config.APP_RING_NAME] = ringbuffer.SampleRing.create(config.APP_RING_NAME, config.APP_RING_CAPACITY)
+    hub_rings[config.VIS_RING_NAME] = ringbuffer.SampleRing.create(config.VIS_RING_NAME, config.VIS_RING_CAPACITY)
+
+    print("--- APP: Starting Hub Process + Listener Threads... ---")
+    threading.Thread(target=listener.supervise, args=(config.HUB_ROUTES, hub_stop), daemon=True).start()
+    threading.Thread(target=hub_music_listener, args=(hub_rings[config.APP_RING_NAME],), daemon=True).start()
+    threading.Thread(target=hub_state_sync, daemon=True).start()
+
+    # Visualizer starts now (idle) so toggling Wand Mode / Replay never waits for a process
+    spawned_at = time.perf_counter()
+    start_visualizer()
+    threading.Thread(target=measure_visualizer_startup, args=(spawned_at,), daemon=True).start()
     
+    # Short GIL slices: request threads cannot delay a MIDI thread that just woke up
+    sys.setswitchinterval(config.GIL_SWITCH_INTERVAL)
+
     try:
-        # debug=True can sometimes interfere with signal handling, 
-        # but use_reloader=False helps keep it stable.
-        # app.run(debug=True, threaded=True, use_reloader=False,port=5050)
-        app.run(debug=True, threaded=True, use_reloader=False)
+        if serve is not None:
+            print(f"--- APP: Serving on http://{config.HTTP_HOST}:{config.HTTP_PORT} ({config.HTTP_THREADS} threads) ---")
+            serve(app, host=config.HTTP_HOST, port=config.HTTP_PORT, threads=config.HTTP_THREADS)
+        else:
+            print("--- APP: waitress not installed, falling back to the Flask development server ---")
+            app.run(host=config.HTTP_HOST, port=config.HTTP_PORT, threaded=True, use_reloader=False)
     finally:
         # This block runs when you hit Ctrl+C or the app crashes
         cleanup()
\ No newline at end of file
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clocksync
+
+# --- TIMESTAMP JITTER BENCHMARK ---
+# Simulates a wand streaming at 100 Hz through a USB-serial bridge into the
+# hub's polling loop, then compares two ways of timestamping the samples:
+#   receive time  - time.time() when the hub read the line (the old way)
+#   device clock  - the wand's micros() mapped through clocksync.ClockSync
+# Error is measured against the true sample time (the constant transport
+# delay is removed, only the jitter counts).
+#
+#   python benchmarks/bench_clock_jitter.py --seconds 120 --drift-ppm 40 --latency-timer 0.016
+
+
+def simulate(seconds, rate, drift_ppm, latency_timer, usb_frame, poll_interval, hiccup_rate, seed):
+    """ Returns (true host time, device micros, receive time) per sample """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    true_t = 1_700_000_000.0 + np.arange(n) / rate + rng.normal(0, 20e-6, n)  # loop start jitter on the ESP32
+
+    # Device clock: own rate, arbitrary origin close to the 32-bit wrap
+    device_us = ((true_t - true_t[0]) * (1 + drift_ppm * 1e-6) * 1e6 + (1 << 32) - 5_000_000).astype(np.int64)
+    device_us %= 1 << 32
+
+    # Line leaves the UART (~70 bytes at 921600 baud), the bridge holds it until
+    # its latency timer fires, then the next USB frame carries it
+    avail = true_t + 70 * 10 / 921600
+    if latency_timer > 0:
+        avail = np.ceil((avail - true_t[0]) / latency_timer) * latency_timer + true_t[0]
+    avail = np.ceil((avail - true_t[0]) / usb_frame) * usb_frame + true_t[0] + 50e-6
+
+    # Hub polling loop: ~1 ms sleeps, occasionally stalled by the OS / GIL
+    n_polls = int(seconds / poll_interval * 1.2) + 1000
+    gaps = poll_interval + rng.exponential(100e-6, n_polls)
+    stalls = rng.random(n_polls) < hiccup_rate
+    gaps[stalls] += rng.exponential(8e-3, int(stalls.sum()))
+    polls = true_t[0] + np.cumsum(gaps)
+    rx_time = polls[np.minimum(np.searchsorted(polls, avail), n_polls - 1)]
+    return true_t, device_us, rx_time
+
+
+def jitter_stats(stamps, true_t, rate):
+    err = stamps - true_t
+    err -= np.median(err)
+    intervals = np.diff(stamps) - 1.0 / rate
+    return {
+        "jitter_std_ms": float(err.std() * 1000),
+        "p99_abs_err_ms": float(np.percentile(np.abs(err), 99) * 1000),
+        "max_abs_err_ms": float(np.abs(err).max() * 1000),
+        "interval_std_ms": float(intervals.std() * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Timestamp jitter: receive time vs. device clock sync")
+    parser.add_argument("--seconds", type=float, default=120.0, help="Simulated session length")
+    parser.add_argument("--rate", type=float, default=100.0, help="Wand sample rate (Hz)")
+    parser.add_argument("--drift-ppm", type=float, default=40.0, help="Device crystal error vs. host")
+    parser.add_argument("--latency-timer", type=float, default=0.016, help="USB-serial bridge latency timer (s, 0 = none)")
+    parser.add_argument("--usb-frame", type=float, default=0.001, help="USB frame period (s)")
+    parser.add_argument("--poll", type=float, default=0.001, help="Hub polling loop sleep (s)")
+    parser.add_argument("--hiccups", type=float, default=0.005, help="Share of polls stalled by the OS")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    true_t, device_us, rx_time = simulate(args.seconds, args.rate, args.drift_ppm, args.latency_timer,
+                                          args.usb_frame, args.poll, args.hiccups, args.seed)
+
+    sync = clocksync.ClockSync()
+    synced = np.empty_like(rx_time)
+    t0 = time.perf_counter()
+    for i in range(len(rx_time)):
+        synced[i] = sync.to_host(int(device_us[i]), float(rx_time[i]))
+    cost = (time.perf_counter() - t0) / len(rx_time)
+
+    # The estimate needs a few windows to settle; score the steady state
+    settle = int(clocksync.WINDOW * clocksync.HISTORY * args.rate // 3)
+    report = {
+        "samples": len(rx_time),
+        "receive_time": jitter_stats(rx_time[settle:], true_t[settle:], args.rate),
+        "device_clock": jitter_stats(synced[settle:], true_t[settle:], args.rate),
+        "sync_cost_us": cost * 1e6,
+        "drift_estimate_ppm": sync.drift_ppm,
+        "drift_true_ppm": args.drift_ppm,
+    }
+
+    print(f"--- BENCH: {len(rx_time)} samples at {args.rate:.0f} Hz, drift {args.drift_ppm:.0f} ppm, "
+          f"latency timer {args.latency_timer * 1000:.0f} ms ---")
+    print(f"{'':14s} {'jitter std':>11s} {'p99 |err|':>10s} {'max |err|':>10s} {'interval std':>13s}")
+    for name in ("receive_time", "device_clock"):
+        row = report[name]
+        print(f"{name:14s} {row['jitter_std_ms']:8.3f} ms {row['p99_abs_err_ms']:7.3f} ms "
+              f"{row['max_abs_err_ms']:7.3f} ms {row['interval_std_ms']:10.3f} ms")
+    print(f"ClockSync: {report['sync_cost_us']:.1f} us/sample, drift estimate "
+          f"{report['drift_estimate_ppm']:.1f} ppm (true {args.drift_ppm:.1f})")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import requests
+import fixtures
+
+# --- HTTP LOAD BENCHMARK ---
+# Starts a song on a running app, then measures MIDI scheduler lateness
+# (midi_scheduler_lateness_seconds from /metrics) twice: once with no HTTP
+# traffic and once while N clients hammer /progress, /set_bpm and
+# /upload_and_play. Request latency per endpoint is reported as well.
+#
+# Every upload is made unique (extra text-event track) so it takes the cold
+# path - store, first-bar compile, library insert - instead of a dedup hit;
+# the library collects one entry per upload. An upload also stops the song
+# that is playing and starts the uploaded copy from bar 1 (paused until the
+# client's /resume), so the loaded phase contains song restarts; they are
+# counted and reported next to the lateness numbers.
+#
+#   python app.py                                    (in another terminal)
+#   python benchmarks/bench_load.py --clients 16 --duration 20
+
+LATENESS_METRIC = "midi_scheduler_lateness_seconds"
+# Share of each endpoint in the generated traffic (tablets mostly poll)
+ENDPOINT_MIX = (("progress", 0.80), ("set_bpm", 0.17), ("upload_and_play", 0.03))
+
+
+def scrape_histogram(base_url, name):
+    """ /metrics -> ({upper bound: cumulative count}, sum, count) for an unlabelled histogram """
+    text = requests.get(f"{base_url}/metrics", timeout=5).text
+    buckets, total, count = {}, 0.0, 0
+    for line in text.splitlines():
+        if line.startswith(name + "_bucket{"):
+            bound = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets[float(bound)] = int(float(line.rsplit(" ", 1)[1]))
+        elif line.startswith(name + "_sum "):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(name + "_count "):
+            count = int(float(line.rsplit(" ", 1)[1]))
+    return buckets, total, count
+
+
+def histogram_delta(before, after):
+    """ Lateness observed between two scrapes: count, mean and bucket-resolution quantiles """
+    (b0, s0, c0), (b1, s1, c1) = before, after
+    count = c1 - c0
+    if count <= 0:
+        return {"messages": 0}
+    bounds = sorted(b1)
+    cumulative = [b1[b] - b0.get(b, 0) for b in bounds]
+
+    def quantile(q):
+        target = q * count
+        for bound, cum in zip(bounds, cumulative):
+            if cum >= target:
+                return bound
+        return float('inf')
+
+    return {
+        "messages": count,
+        "mean_ms": (s1 - s0) / count * 1000,
+        "p50_ms<=": quantile(0.50) * 1000,
+        "p99_ms<=": quantile(0.99) * 1000,
+        "over_5ms": 1.0 - (cumulative[bounds.index(0.005)] / count if 0.005 in bounds else 0.0),
+    }
+
+
+def unique_upload(midi_bytes, tag):
+    """ The same score plus one track holding a text meta event: new sha1, identical music """
+    text = tag.encode('ascii')[:127]
+    body = b'\x00\xff\x01' + bytes([len(text)]) + text + b'\x00\xff\x2f\x00'
+    midi_type, n_tracks = struct.unpack('>hh', midi_bytes[8:12])
+    header = midi_bytes[:8] + struct.pack('>hh', max(midi_type, 1), n_tracks + 1)
+    return header + midi_bytes[12:] + b'MTrk' + struct.pack('>L', len(body)) + body
+
+
+def client(base_url, midi_bytes, stop, results, seed):
+    rng = random.Random(seed)
+    uploads = 0
+    session = requests.Session()
+    names = [n for n, _ in ENDPOINT_MIX]
+    weights = [w for _, w in ENDPOINT_MIX]
+    while not stop.is_set():
+        name = rng.choices(names, weights)[0]
+        t0 = time.perf_counter()
+        try:
+            if name == "progress":
+                r = session.get(f"{base_url}/progress", timeout=10)
+            elif name == "set_bpm":
+                r = session.post(f"{base_url}/set_bpm", json={"bpm": rng.uniform(60, 180)}, timeout=10)
+            else:
+                uploads += 1
+                upload = unique_upload(midi_bytes, f"load benchmark {seed}-{uploads} {time.time()}")
+                r = session.post(f"{base_url}/upload_and_play", data={"wand_mode": "false"},
+                                 files={"midiFile": ("load_benchmark.mid", upload, "audio/midi")}, timeout=30)
+                # The upload replaced the song; auto-tempo uploads start paused, press play like the UI does
+                session.post(f"{base_url}/resume", timeout=10)
+            ok = r.status_code < 500
+        except requests.RequestException:
+            ok = False
+        results.append((name, time.perf_counter() - t0, ok))
+
+
+def request_stats(results, duration):
+    stats = {}
+    for name, _ in ENDPOINT_MIX:
+        lat = sorted(t for n, t, _ in results if n == name)
+        errors = sum(1 for n, _, ok in results if n == name and not ok)
+        if not lat:
+            continue
+        stats[name] = {
+            "requests": len(lat),
+            "per_sec": len(lat) / duration,
+            "p50_ms": lat[len(lat) // 2] * 1000,
+            "p99_ms": lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000,
+            "errors": errors,
+        }
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the control API while measuring MIDI scheduler lateness")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base URL of the running app")
+    parser.add_argument("--midi", default=None, help="Score to play (default: generated dense 4-channel file)")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent HTTP clients")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds per phase (idle, then loaded)")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+    base_url = args.url.rstrip("/")
+
+    if args.midi:
+        midi_path = args.midi
+    else:
+        midi_path = os.path.join(tempfile.mkdtemp(), "load_benchmark.mid")
+        fixtures.make_midi(midi_path)
+    with open(midi_path, 'rb') as f:
+        midi_bytes = f.read()
+
+    # Start playback (auto-tempo, no wand needed) and let the engine settle
+    r = requests.post(f"{base_url}/upload_and_play", data={"wand_mode": "false"},
+                      files={"midiFile": (os.path.basename(midi_path), midi_bytes, "audio/midi")}, timeout=30)
+    r.raise_for_status()
+    requests.post(f"{base_url}/resume", timeout=5)
+    time.sleep(1.0)
+
+    print(f"--- BENCH: idle phase ({args.duration:.0f}s) ---")
+    before = scrape_histogram(base_url, LATENESS_METRIC)
+    time.sleep(args.duration)
+    idle = histogram_delta(before, scrape_histogram(base_url, LATENESS_METRIC))
+
+    print(f"--- BENCH: load phase ({args.clients} clients, {args.duration:.0f}s) ---")
+    stop = threading.Event()
+    results = []
+    threads = [threading.Thread(target=client, args=(base_url, midi_bytes, stop, results, i), daemon=True)
+               for i in range(args.clients)]
+    before = scrape_histogram(base_url, LATENESS_METRIC)
+    for t in threads: t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads: t.join()
+    loaded = histogram_delta(before, scrape_histogram(base_url, LATENESS_METRIC))
+    requests.post(f"{base_url}/stop", timeout=5)
+
+    restarts = sum(1 for n, _, ok in results if n == "upload_and_play" and ok)
+    report = {"clients": args.clients, "duration": args.duration,
+              "lateness_idle": idle, "lateness_loaded": loaded, "song_restarts": restarts,
+              "requests": request_stats(results, args.duration)}
+
+    for phase in ("lateness_idle", "lateness_loaded"):
+        row = report[phase]
+        if not row.get("messages"):
+            print(f"{phase:16s} no MIDI messages observed (is a song playing?)")
+            continue
+        print(f"{phase:16s} msgs={row['messages']:6d}  mean={row['mean_ms']:.3f}ms  "
+              f"p50<={row['p50_ms<=']:.2f}ms  p99<={row['p99_ms<=']:.2f}ms  >5ms={row['over_5ms'] * 100:.2f}%")
+    print(f"{'':16s} loaded phase includes {restarts} song restarts (one per upload)")
+    for name, row in report["requests"].items():
+        print(f"{name:16s} {row['per_sec']:7.1f} req/s  p50={row['p50_ms']:.1f}ms  "
+              f"p99={row['p99_ms']:.1f}ms  errors={row['errors']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import fixtures
+
+# --- MICRO-BENCHMARK SUITE ---
+# Times the per-item cost of the GUI hot paths on fixed inputs (the bundled
+# wand_data_*.csv captures and synthetic MIDI files), and stores / compares
+# named baselines so every change to these paths can show its speed impact.
+#
+#   python benchmarks/bench_micro.py --save reference   # record baselines/reference.json
+#   python benchmarks/bench_micro.py --compare reference # run again, print the deltas
+#   python benchmarks/bench_micro.py -k trace           # only benchmarks matching "trace"
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+BENCHMARKS = {}     # name -> setup(ctx) returning (run, ops per run)
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class FakePort:
+    """ MIDI output that drops everything (measures the engine, not the synth) """
+
+    def send(self, msg):
+        pass
+
+
+# --- FIXTURE CONTEXT (built once, lazily) ---
+class Context:
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self._cache = {}
+
+    def get(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def rows(self):
+        return self.get("rows", fixtures.wand_capture_rows)
+
+    @property
+    def lines(self):
+        return self.get("lines", lambda: fixtures.wand_lines(self.rows))
+
+    @property
+    def records(self):
+        def build():
+            import listener
+            return [listener.parse_line(line) for line in self.lines]
+        return self.get("records", build)
+
+    def rings(self):
+        """ Private app / visualizer rings (same subscriptions as the hub's), large enough for the whole capture """
+        import config
+        import listener
+        import ringbuffer
+        size = len(self.records) + 1
+        names = {name: f"smartbaton_bench_{os.getpid()}_{i}" for i, name in enumerate(config.HUB_ROUTES)}
+        rings = {name: ringbuffer.SampleRing.create(private, size) for name, private in names.items()}
+        self.get("rings", lambda: []).extend(rings.values())
+        router = listener.Router([(rings[name], types) for name, types in config.HUB_ROUTES.items()])
+        return rings, router
+
+    def ring(self, name):
+        """ The capture as the hub would have published it into one consumer's ring """
+        def build():
+            rings, router = self.rings()
+            for i, (kind, val, text, _) in enumerate(self.records):
+                router.publish(kind, i * 0.01, val, text)
+            return rings
+        return self.get("routed", build)[name]
+
+    def midi(self, name, make, **kwargs):
+        path = os.path.join(self.workdir, name)
+        return self.get(path, lambda: make(path, **kwargs) or path)
+
+    def close(self):
+        for ring in self._cache.get("rings", []):
+            ring.close()
+
+
+def rewind(reader, n):
+    """ Puts a reader n records behind the head so the next poll() returns them again """
+    reader.cursor = reader.ring.head - n
+
+
+# --- HUB ---
+@benchmark("hub.parse_line")
+def bench_parse_line(ctx):
+    import listener
+    lines = ctx.lines
+    return lambda: [listener.parse_line(line) for line in lines], len(lines)
+
+
+@benchmark("hub.route")
+def bench_route(ctx):
+    """ Fan-out of every record into the subscribed consumer rings """
+    records = ctx.records
+    _, router = ctx.rings()
+
+    def run():
+        for i, (kind, val, text, _) in enumerate(records):
+            router.publish(kind, i * 0.01, val, text)
+    return run, len(records)
+
+
+@benchmark("hub.clock_sync")
+def bench_clock_sync(ctx):
+    import clocksync
+    stamps = [(i * fixtures.SAMPLE_PERIOD_US, 1000.0 + i * 0.01 + (i % 7) * 0.001) for i in range(len(ctx.rows))]
+
+    def run():
+        sync = clocksync.ClockSync()
+        for device_us, rx_time in stamps:
+            sync.to_host(device_us, rx_time)
+    return run, len(stamps)
+
+
+# --- APP (music listener, replay, metadata, engine) ---
+@benchmark("app.consume_hub_views")
+def bench_consume_hub_views(ctx):
+    import app
+    import config
+    import ringbuffer
+    ring = ctx.ring(config.APP_RING_NAME)
+    reader = ringbuffer.RingReader(ring)
+    n = ring.head
+    app.playback_state.update(in_warmup=False, wand_enabled=True, replay_active=False)
+
+    def run():
+        rewind(reader, n)
+        app.consume_hub_views(reader.poll())
+    return run, n
+
+
+@benchmark("app.load_replay_rows")
+def bench_load_replay_rows(ctx):
+    import app
+    path = os.path.join(ctx.workdir, "session.csv")
+    fixtures.write_recording(path, ctx.rows)
+    return lambda: app.load_replay_rows(path), len(ctx.rows)
+
+
+@benchmark("app.replay_row")
+def bench_replay_row(ctx):
+    import app
+    import config
+    path = os.path.join(ctx.workdir, "session.csv")
+    fixtures.write_recording(path, ctx.rows)
+    rows = app.load_replay_rows(path)
+    # INJECT lines go to a throwaway socket, not to a hub that may be running
+    sink = ctx.get("sink", lambda: socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    sink.bind((config.IP, 0))
+    config.PORT_CMD = sink.getsockname()[1]
+    app.playback_state.update(replay_active=True, wand_enabled=False)
+
+    def run():
+        for row in rows:
+            app.replay_row(row)
+    return run, len(rows)
+
+
+@benchmark("app.metadata_midifile")
+def bench_metadata_midifile(ctx):
+    import mido
+    import app
+    mid = mido.MidiFile(ctx.midi("orchestral.mid", fixtures.make_orchestral_midi))
+
+    def run():
+        app.extract_smart_metadata(mid)
+        app.get_weight_count(mid)
+        app.get_start_bpm(mid)
+    return run, 1
+
+
+@benchmark("app.metadata_first_bar")
+def bench_metadata_first_bar(ctx):
+    import app
+    import timeline
+    tl = timeline.compile_streaming(ctx.midi("orchestral.mid", fixtures.make_orchestral_midi))
+    tl.wait_complete()
+
+    def run():
+        head = tl.first_events(tl.first_bar_ticks)
+        app.extract_smart_metadata(head)
+        app.get_weight_count(head)
+        app.get_start_bpm(head)
+    return run, 1
+
+
+@benchmark("engine.play_stream")
+def bench_play_stream(ctx):
+    import threading
+    import app
+    import timeline
+    tl = timeline.compile_streaming(ctx.midi("dense.mid", fixtures.make_midi, bars=100))
+    tl.wait_complete()
+    port, lock = FakePort(), threading.Lock()
+    state = app.playback_state
+
+    def run():
+        # Wand Mode at an absurd BPM: every wait is ~0, what is left is per-message overhead
+        state.update(is_playing=True, is_paused=False, wand_enabled=True, wand_connected=True,
+                     replay_active=False, bpm=1e9, current_ticks=0)
+        app.play_stream(tl.messages, tl.ticks_per_beat, port, lock, tl=tl)
+    return run, len(tl.messages)
+
+
+# --- VISUALIZER ---
+@benchmark("trace.drain_ring")
+def bench_drain_ring(ctx):
+    import config
+    import trace
+    import ringbuffer
+    trace.load_modules()
+    trace.raw_wand_vector = trace.np.array([1.0, 0.0, 0.0], dtype=trace.np.float32)
+    ring = ctx.ring(config.VIS_RING_NAME)
+    reader = ringbuffer.RingReader(ring)
+    n = ring.head
+
+    def run():
+        rewind(reader, n)
+        trace.drain_ring(reader)
+    return run, n
+
+
+@benchmark("trace.drain_ring_frame")
+def bench_drain_ring_frame(ctx):
+    """ Realistic 60 FPS frame: ~2 new records per drain, so the fixed per-poll cost dominates """
+    import config
+    import trace
+    import ringbuffer
+    trace.load_modules()
+    trace.raw_wand_vector = trace.np.array([1.0, 0.0, 0.0], dtype=trace.np.float32)
+    reader = ringbuffer.RingReader(ctx.ring(config.VIS_RING_NAME))
+    frames = 20000
+
+    def run():
+        for _ in range(frames):
+            rewind(reader, 2)
+            trace.drain_ring(reader)
+    return run, frames
+
+
+@benchmark("trace.alignment")
+def bench_alignment(ctx):
+    import trace
+    trace.load_modules()
+    np = trace.np
+    vectors = np.array([r[:3] for r in ctx.rows], dtype=np.float32)
+    target = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+    def run():
+        for v in vectors:
+            correction = trace.get_rotation_matrix(v, target)
+            np.dot(correction, v)
+    return run, len(vectors)
+
+
+# --- RUNNER ---
+def time_benchmark(setup, ctx, repeat):
+    run, ops = setup(ctx)
+    run()  # warm-up (imports, caches)
+    per_op = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        run()
+        per_op.append((time.perf_counter() - t0) / ops)
+    return {"ops": ops, "min_us": min(per_op) * 1e6, "median_us": statistics.median(per_op) * 1e6}
+
+
+def load_baseline(name):
+    with open(os.path.join(BASELINE_DIR, f"{name}.json")) as f:
+        return json.load(f)
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    doc = {
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} {platform.processor()}".strip(),
+        "results": results,
+    }
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, 'w') as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the GUI hot paths")
+    parser.add_argument("-k", dest="pattern", default=None, help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--save", metavar="NAME", help="Store the results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare against baselines/NAME.json")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change flagged as faster / SLOWER")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit 1 if anything got slower than --threshold")
+    parser.add_argument("--list", action="store_true", help="List benchmark names and exit")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    names = [n for n in BENCHMARKS if args.pattern is None or args.pattern in n]
+    if args.list:
+        print("\n".join(names))
+        return
+    baseline = load_baseline(args.compare)["results"] if args.compare else {}
+    json_path = os.path.abspath(args.json) if args.json else None  # before the chdir below
+
+    # The app / hub modules create uploads/ and logs/ relative to the working
+    # directory - keep those (and the fixtures) in a scratch dir
+    sys.path.insert(0, fixtures.GUI_DIR)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="smartbaton_bench_")
+    os.chdir(workdir)
+    ctx = Context(workdir)
+
+    results = {}
+    regressions = 0
+    header = f"{'benchmark':26s} {'median':>12s} {'min':>12s} {'ops':>7s}"
+    if baseline:
+        header += f" {'base min':>12s} {'change':>8s}"
+    print(header)
+    try:
+        for name in names:
+            row = time_benchmark(BENCHMARKS[name], ctx, args.repeat)
+            results[name] = row
+            line = f"{name:26s} {row['median_us']:9.2f} us {row['min_us']:9.2f} us {row['ops']:7d}"
+            base = baseline.get(name)
+            if base:
+                # min, not median: on a busy machine the fastest run is the reproducible one
+                change = (row['min_us'] / base['min_us'] - 1.0) * 100
+                verdict = ""
+                if change > args.threshold:
+                    verdict = "  SLOWER"
+                    regressions += 1
+                elif change < -args.threshold:
+                    verdict = "  faster"
+                line += f" {base['min_us']:9.2f} us {change:+7.1f}%{verdict}"
+            elif baseline:
+                line += f" {'(new)':>12s}"
+            print(line, flush=True)
+    finally:
+        ctx.close()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        print(f"--- BENCH: baseline saved to {save_baseline(args.save, results)} ---")
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tty
+import numpy as np
+import fixtures
+
+sys.path.insert(0, fixtures.GUI_DIR)
+os.chdir(tempfile.mkdtemp(prefix="smartbaton_bench_"))  # the hub creates logs/ on import
+import config
+import listener
+import ringbuffer
+
+# --- HUB ROUTING BENCHMARK ---
+# Runs the real hub loop against a pseudo-terminal "wand" (Linux / macOS) and
+# measures how long BEAT_TRIG lines take from the serial port to the app's
+# ring reader - first under normal traffic, then under a DATA + LOG: flood
+# where every beat shares its serial read with a pile of telemetry. Also
+# reports the hub's per-type dispatch latency and what the LOG limiter let
+# through to the visualizer.
+#
+#   python benchmarks/bench_routing.py --seconds 10 --flood-data-hz 1000 --flood-log-rate 2000
+
+POLL_SLEEP = 0.002  # same idle sleep as app.hub_music_listener
+
+
+def feed(master, seconds, data_hz, log_rate, beat_every, stamps, counts):
+    """ Writes wand lines into the pty on a 1 ms tick; each beat goes LAST in its write """
+    t0 = time.perf_counter()
+    next_beat = beat_every
+    while (elapsed := time.perf_counter() - t0) < seconds:
+        lines = []
+        n_data = int(elapsed * data_hz) - counts["DATA"]
+        lines += [b"DATA,0.1000,0.2000,0.9700"] * n_data
+        n_log = int(elapsed * log_rate) - counts["LOG"]
+        lines += [b"LOG: weight detect debug, accel window %d" % (counts["LOG"] + i) for i in range(n_log)]
+        counts["DATA"] += n_data
+        counts["LOG"] += n_log
+        beat = elapsed >= next_beat
+        if beat:
+            lines += [b"BEAT_TRIG", b"BPM: 90.00"]
+            next_beat += beat_every
+            stamps.append(time.time())
+        if lines:
+            os.write(master, b"\n".join(lines) + b"\n")
+        time.sleep(0.001)
+
+
+def consume(app_ring, vis_ring, stamps, result, stop):
+    """ App-side reader (beats) + visualizer-side reader (telemetry counts) """
+    app_reader = ringbuffer.RingReader(app_ring)
+    vis_reader = ringbuffer.RingReader(vis_ring)
+    while not stop.is_set():
+        views = app_reader.poll()
+        now = time.time()
+        for view in views:
+            for rx in view['rx'][view['kind'] == ringbuffer.KIND_BEAT_TRIG]:
+                i = len(result["beat_latency"])
+                result["beat_latency"].append(now - stamps[i])
+                result["beat_from_rx"].append(now - float(rx))
+        for view in vis_reader.poll():
+            for kind in (ringbuffer.KIND_DATA, ringbuffer.KIND_LOG):
+                result[ringbuffer.KIND_NAMES[kind]] += int(np.count_nonzero(view['kind'] == kind))
+        result["vis_dropped"] = vis_reader.dropped
+        if not views:
+            time.sleep(POLL_SLEEP)
+
+
+def hub_dispatch(cmd_port):
+    """ HUB:METRICS -> {type: (count, sum)} of hub_dispatch_latency_seconds """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.0)
+    sock.sendto(b"HUB:METRICS", (config.IP, cmd_port))
+    text = sock.recv(65535).decode('utf-8')
+    sock.close()
+    out = {}
+    for line in text.splitlines():
+        for suffix, field in (("_count{", 0), ("_sum{", 1)):
+            if line.startswith("hub_dispatch_latency_seconds" + suffix):
+                ptype = line.split('type="', 1)[1].split('"', 1)[0]
+                out.setdefault(ptype, [0, 0.0])[field] = float(line.rsplit(" ", 1)[1])
+    return out
+
+
+def run_phase(master, app_ring, vis_ring, cmd_port, seconds, data_hz, log_rate, beat_every):
+    stamps = []
+    counts = {"DATA": 0, "LOG": 0}
+    result = {"beat_latency": [], "beat_from_rx": [], "DATA": 0, "LOG": 0, "vis_dropped": 0}
+    stop = threading.Event()
+    before = hub_dispatch(cmd_port)
+    reader = threading.Thread(target=consume, args=(app_ring, vis_ring, stamps, result, stop), daemon=True)
+    reader.start()
+    feed(master, seconds, data_hz, log_rate, beat_every, stamps, counts)
+    time.sleep(0.3)  # let the hub catch up with the tail
+    stop.set()
+    reader.join()
+    after = hub_dispatch(cmd_port)
+
+    lat = np.array(result["beat_latency"]) * 1000
+    dispatch = {}
+    for ptype, (count, total) in after.items():
+        c0, s0 = before.get(ptype, (0, 0.0))
+        if count > c0:
+            dispatch[ptype] = (total - s0) / (count - c0) * 1000
+    return {
+        "beats_sent": len(stamps),
+        "beats_received": len(lat),
+        "beat_p50_ms": float(np.percentile(lat, 50)) if len(lat) else None,
+        "beat_p99_ms": float(np.percentile(lat, 99)) if len(lat) else None,
+        "beat_max_ms": float(lat.max()) if len(lat) else None,
+        "data_sent": counts["DATA"],
+        "data_to_vis": result["DATA"],
+        "log_sent": counts["LOG"],
+        "log_to_vis": result["LOG"],
+        "vis_dropped": result["vis_dropped"],
+        "hub_dispatch_mean_ms": dispatch,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Beat delivery latency through the hub, idle vs. telemetry flood")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Length of each phase")
+    parser.add_argument("--beat-every", type=float, default=0.5, help="Seconds between BEAT_TRIG lines")
+    parser.add_argument("--data-hz", type=float, default=100.0, help="DATA rate in the normal phase")
+    parser.add_argument("--flood-data-hz", type=float, default=1000.0, help="DATA rate in the flood phase")
+    parser.add_argument("--flood-log-rate", type=float, default=2000.0, help="LOG: lines per second in the flood phase")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    # Pseudo-terminal wand + private rings / command port, so a running app is never touched
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind((config.IP, 0))
+    cmd_port = probe.getsockname()[1]
+    probe.close()
+    config.WAND_PORTS = [os.ttyname(slave)]
+    config.PORT_CMD = cmd_port
+
+    names = {name: f"smartbaton_bench_{os.getpid()}_{i}" for i, name in enumerate(config.HUB_ROUTES)}
+    app_ring = ringbuffer.SampleRing.create(names[config.APP_RING_NAME], config.APP_RING_CAPACITY)
+    vis_ring = ringbuffer.SampleRing.create(names[config.VIS_RING_NAME], config.VIS_RING_CAPACITY)
+    routes = {names[name]: types for name, types in config.HUB_ROUTES.items()}
+
+    # fork: the hub inherits the patched config (ports, command port)
+    hub = multiprocessing.get_context("fork").Process(target=listener.listen, args=(routes,), daemon=True)
+    hub.start()
+    try:
+        time.sleep(1.0)
+        report = {"seconds": args.seconds}
+        phases = (("normal", args.data_hz, 0.0), ("flood", args.flood_data_hz, args.flood_log_rate))
+        for phase, data_hz, log_rate in phases:
+            print(f"--- BENCH: {phase} phase ({data_hz:.0f} DATA/s, {log_rate:.0f} LOG/s, {args.seconds:.0f}s) ---")
+            report[phase] = run_phase(master, app_ring, vis_ring, cmd_port, args.seconds,
+                                      data_hz, log_rate, args.beat_every)
+    finally:
+        hub.terminate()
+        hub.join(1.0)
+        app_ring.close()
+        vis_ring.close()
+
+    print(f"{'phase':8s} {'beats':>7s} {'p50':>9s} {'p99':>9s} {'max':>9s} {'LOG sent':>9s} {'to vis':>7s}  hub dispatch mean")
+    for phase, _, _ in phases:
+        row = report[phase]
+        if not row["beats_received"]:
+            print(f"{phase:8s} no beats received")
+            continue
+        dispatch = "  ".join(f"{t}={ms:.3f}ms" for t, ms in sorted(row["hub_dispatch_mean_ms"].items()))
+        print(f"{phase:8s} {row['beats_received']:3d}/{row['beats_sent']:<3d} {row['beat_p50_ms']:6.2f} ms "
+              f"{row['beat_p99_ms']:6.2f} ms {row['beat_max_ms']:6.2f} ms {row['log_sent']:9d} {row['log_to_vis']:7d}  {dispatch}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import csv
+import glob
+import os
+import mido
+
+# --- BENCHMARK FIXTURES ---
+# Deterministic inputs shared by the benchmarks: wand traffic rebuilt from
+# the bundled wand_data_*.csv captures, and synthetic MIDI files.
+
+GUI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PERIOD_US = 10000    # the wand streams at 100 Hz
+BPM_EVERY = 10              # one "BPM: n" line per this many samples
+
+
+def make_midi(path, bars=400, channels=4, ticks_per_beat=480):
+    """ Dense synthetic score: 16th notes on every channel, long enough to outlast the benchmark """
+    mid = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    step = ticks_per_beat // 4
+    for ch in range(channels):
+        track = mido.MidiTrack()
+        if ch == 0:
+            track.append(mido.MetaMessage('track_name', name='Load Benchmark', time=0))
+            track.append(mido.MetaMessage('time_signature', numerator=4, denominator=4, time=0))
+            track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(120), time=0))
+        for i in range(bars * 16):
+            note = 48 + ch * 7 + (i % 12)
+            track.append(mido.Message('note_on', channel=ch, note=note, velocity=80, time=0))
+            track.append(mido.Message('note_off', channel=ch, note=note, velocity=0, time=step))
+        mid.tracks.append(track)
+    mid.save(path)
+
+
+def make_orchestral_midi(path, tracks=32, notes_per_track=6000, ticks_per_beat=480):
+    """
+    Large multi-track file in the shape of a real orchestral export: a
+    conductor track (name, meter, tempo changes) plus named instrument tracks
+    whose metadata sits at the start, followed by long note runs.
+    """
+    mid = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    conductor = mido.MidiTrack()
+    conductor.append(mido.MetaMessage('track_name', name='Symphony No. 5 in C minor', time=0))
+    conductor.append(mido.MetaMessage('time_signature', numerator=2, denominator=4, time=0))
+    conductor.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(108), time=0))
+    for i in range(1, 64):
+        conductor.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(96 + i % 24), time=ticks_per_beat * 8))
+    mid.tracks.append(conductor)
+
+    for t in range(tracks - 1):
+        track = mido.MidiTrack()
+        ch = t % 16
+        track.append(mido.MetaMessage('track_name', name='by Ludwig van Beethoven' if t == 0 else f'Part {t + 1}', time=0))
+        track.append(mido.Message('program_change', channel=ch, program=t % 128, time=0))
+        for i in range(notes_per_track):
+            note = 36 + (t * 5 + i * 7) % 60
+            track.append(mido.Message('note_on', channel=ch, note=note, velocity=64 + i % 40, time=0))
+            track.append(mido.Message('note_off', channel=ch, note=note, velocity=0, time=ticks_per_beat // 4))
+        mid.tracks.append(track)
+    mid.save(path)
+
+
+def wand_capture_rows():
+    """ All bundled IMU captures concatenated: [(ax, ay, az, beat_event), ...] """
+    rows = []
+    for path in sorted(glob.glob(os.path.join(GUI_DIR, "wand_data_*.csv"))):
+        with open(path, newline='') as f:
+            for rec in csv.DictReader(f):
+                rows.append((float(rec['ax']), float(rec['ay']), float(rec['az']), rec['beat_event'] == '1'))
+    return rows
+
+
+def wand_lines(rows, stamped=True):
+    """
+    The serial lines the wand firmware would print for these samples:
+    DATA,x,y,z[,us] every sample, BEAT_TRIG[,us] + BEAT: n on beats, BPM: n every 10th.
+    """
+    lines = []
+    beat = 0
+    for i, (x, y, z, is_beat) in enumerate(rows):
+        us = f",{i * SAMPLE_PERIOD_US}" if stamped else ""
+        lines.append(f"DATA,{x:.4f},{y:.4f},{z:.4f}{us}")
+        if is_beat:
+            beat = beat % 4 + 1
+            lines.append(f"BEAT_TRIG{us}")
+            lines.append(f"BEAT: {beat}")
+        if i % BPM_EVERY == 0:
+            lines.append(f"BPM: {80 + i % 40}")
+    return lines
+
+
+def write_recording(path, rows, bpm=90.0):
+    """ A listener-style session recording (Timestamp, X, Y, Z, bpm, wand) for the replay path """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Timestamp", "X", "Y", "Z", "bpm", "wand"])
+        for i, (x, y, z, _) in enumerate(rows):
+            writer.writerow([1_700_000_000.0 + i * SAMPLE_PERIOD_US * 1e-6, x, y, z, bpm, 0])
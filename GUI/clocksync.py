@@ -0,0 +1,82 @@
+from collections import deque
+import numpy as np
+
+# --- DEVICE CLOCK SYNC ---
+# The wand stamps every DATA / BEAT_TRIG line with its own micros() counter.
+# Receive time on the host = sample time + transport delay, and that delay
+# only ever adds (USB-serial buffering, the hub's polling loop). So the
+# smallest (host - device) difference seen in a window is the cleanest
+# estimate of the clock offset. A line fitted through the per-window minima
+# gives offset + drift, and every sample is mapped through that line into
+# the host time domain - the jitter is gone, the wall clock stays the same.
+
+WRAP = 1 << 32              # micros() is an unsigned 32-bit counter (wraps every ~71 min)
+WINDOW = 1.0                # seconds of device time per minimum
+HISTORY = 30                # windows in the drift fit (~30 s)
+RESET_ERROR = 0.5           # seconds; a bigger mismatch means the wand rebooted -> start over
+
+
+class ClockSync:
+    """ Maps one wand's device timestamps (µs) to de-jittered host time (s) """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_raw = None
+        self.wraps = 0
+        self.origin = None          # device seconds of the first sample (keeps the fit well conditioned)
+        self.win_start = None
+        self.win_min = None         # (device x, host - device) smallest delay in the current window
+        self.minima = deque(maxlen=HISTORY)
+        self.offset = None          # host - device at x = 0
+        self.drift = 0.0            # seconds per second (1e-6 = 1 ppm)
+
+    @property
+    def drift_ppm(self):
+        """ Device clock rate error vs. host, positive = device runs fast """
+        return -self.drift * 1e6
+
+    def _unwrap(self, device_us):
+        if self.last_raw is not None and device_us < self.last_raw and self.last_raw - device_us > WRAP // 2:
+            self.wraps += 1
+        self.last_raw = device_us
+        return (device_us + self.wraps * WRAP) * 1e-6
+
+    def _fit(self):
+        if len(self.minima) < 2:
+            self.offset, self.drift = self.minima[0][1], 0.0
+            return
+        x, d = np.array(self.minima).T
+        self.drift, self.offset = np.polyfit(x, d, 1)
+
+    def to_host(self, device_us, rx_time):
+        """ One sample: updates the estimate and returns its host-domain timestamp (never after rx_time) """
+        device_s = self._unwrap(device_us)
+        if self.origin is None:
+            self.origin = device_s
+            self.win_start = 0.0
+        x = device_s - self.origin
+        d = rx_time - device_s
+
+        if self.offset is not None and abs(d - (self.offset + self.drift * x)) > RESET_ERROR:
+            # Device clock jumped (reboot / reflash): the old fit is meaningless
+            self.reset()
+            return self.to_host(device_us, rx_time)
+
+        if self.win_min is None or d < self.win_min[1]:
+            self.win_min = (x, d)
+        if x - self.win_start >= WINDOW:
+            self.minima.append(self.win_min)
+            self.win_start = x
+            self.win_min = None
+            self._fit()
+
+        if self.offset is None:
+            # First window: the smallest delay seen so far is the best guess
+            estimate = self.win_min[1]
+        else:
+            estimate = self.offset + self.drift * x
+            if self.win_min is not None and self.win_min[1] < estimate:
+                estimate = self.win_min[1]
+        return min(device_s + estimate, rx_time)
@@ -1,15 +1,44 @@
 # ------ app.py ------
 PORT_CMD = 5007             # Command port for Listener Hub
 UPLOAD_FOLDER = 'uploads'
+HUB_RESTART_DELAY = 0.5     # First restart delay (s) when the hub process dies, doubles up to 10s
+WAND_STATUS_TIMEOUT = 1.5   # /wand_status: no heartbeat for this long = disconnected
+WAND_HOLD_TIMEOUT = 120.0   # Playback holds this long for a lost wand before giving up (0 = forever)
+HTTP_HOST = '127.0.0.1'     # '0.0.0.0' to serve tablets on the LAN
+HTTP_PORT = 5000
+HTTP_THREADS = 8            # waitress worker threads (concurrent requests)
+GIL_SWITCH_INTERVAL = 0.001 # sys.setswitchinterval: a woken MIDI thread waits at most ~1ms for the GIL
+SIG_LEAD_BEATS = 0.5        # NEXT_SIG goes to the wand this many (old-meter) beats before a mid-song meter change
 
 # ------ listener.py ------
 SERIAL_PORT = 'COM8'    # com port to which the wand is connected, update as needed
+WAND_PORTS = [SERIAL_PORT]  # one entry per wand, list index = wand ID (e.g. ['COM8', 'COM9'])
+WAND_GAP_TIMEOUT = 0.25     # No bytes for this long = link lost (the wand streams DATA continuously)
+WAND_REOPEN_AFTER = 1.0     # A port that streamed, then went silent this long -> close and re-probe it
+WAND_RETRY_MIN = 0.01       # First reopen attempt delay (s), doubles on every failure...
+WAND_RETRY_MAX = 1.0        # ...up to this
+WAND_HEARTBEAT = 0.5        # Seconds between CONNECTED heartbeats while data flows
 BAUD_RATE = 921600     
 IP = "127.0.0.1"
-PORT_MUSIC = 5005       # Port for app.py (BPM)
-PORT_VIS = 5006         # Port for visualizer.py (3D Wand)
 PORT_CMD = 5007         # Listening for commands from app.py
 LOG_DIR = "logs"        # CSV CONFIG
 
+# ------ shared memory (hub -> app / trace) ------
+# One ring per consumer; the hub only publishes the packet types a consumer
+# subscribed to (the app never sees raw samples, the visualizer never sees BPM)
+APP_RING_NAME = "smartbaton_app"    # multiprocessing.shared_memory segment names
+VIS_RING_NAME = "smartbaton_vis"
+APP_RING_CAPACITY = 1024            # control records only (minutes of headroom)
+VIS_RING_CAPACITY = 4096            # records (~2s of wand data at full rate)
+HUB_ROUTES = {
+    APP_RING_NAME: ("BPM", "BEAT", "BEAT_TRIG", "STATUS", "TIME"),
+    VIS_RING_NAME: ("DATA", "BEAT_TRIG", "LOG"),
+}
+LOG_RATE = 20.0         # firmware LOG: lines per second per wand forwarded in full...
+LOG_BURST = 40          # ...with this much burst allowance...
+LOG_SAMPLE_EVERY = 50   # ...past that only 1 in N gets through
+
 # ------ trace.py ------
-WS_PORT = 8765
\ No newline at end of file
+WS_PORT = 8765
+PORT_VIS_CMD = 5008     # UDP control port of the visualizer service (VIS:ACTIVATE / VIS:DEACTIVATE)
+VIS_ACK_TIMEOUT = 0.5   # app waits this long for trace.py to acknowledge a mode switch
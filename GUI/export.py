@@ -0,0 +1,186 @@
+import argparse
+import glob
+import io
+import os
+import struct
+import time
+import mido
+import numpy as np
+from mido.midifiles.midifiles import write_chunk, write_track
+import render
+import timeline
+
+# --- TEMPO-MAPPED EXPORT ---
+# Bakes a conducted session (logs/track_rec_*.csv) into the MIDI file itself:
+# the source tracks are kept as they are, their set_tempo events are replaced
+# by one tempo track that follows the conductor's BPM curve. The result plays
+# the take back in any MIDI player - no wand, no CSV replay.
+#
+#   python export.py song.mid logs/ --out-dir takes
+#   python export.py song.mid logs/track_rec_A.csv --smooth 0.5 --tolerance 1
+
+GRID_HZ = 20                # BPM curve is resampled onto this grid
+SMOOTH_SECONDS = 1.0        # centered moving average window (0 = off)
+TEMPO_TOLERANCE = 0.5       # BPM; smaller changes don't get their own set_tempo
+MIN_TEMPO_GAP = 0.125       # beats; at most one set_tempo per this many beats
+MIN_BPM = 4.0               # set_tempo is 24 bit: slower than ~3.6 BPM does not fit
+
+
+def tempo_curve(times, bpms, grid_hz=GRID_HZ, smooth=SMOOTH_SECONDS):
+    """
+    Recording -> (beats elapsed, bpm) per grid step, pauses cut out.
+    Same rules as the replay: the BPM of the latest row applies, 0 = paused.
+    While paused the song position holds, so those steps are dropped instead
+    of being averaged into the curve.
+    """
+    if len(times) == 0:
+        return np.zeros(0), np.zeros(0)
+    grid = np.arange(0.0, times[-1], 1.0 / grid_hz)
+    live = bpms[np.searchsorted(times, grid, side='right') - 1]
+    live = live[live > 0]
+    if len(live) == 0:
+        return np.zeros(0), np.zeros(0)
+
+    window = int(round(smooth * grid_hz)) | 1  # odd, so the average stays centered
+    if window > 1:
+        half = window // 2
+        csum = np.cumsum(np.pad(live, (half + 1, half), mode='edge'))
+        live = (csum[window:] - csum[:-window]) / window
+
+    beats = np.concatenate(([0.0], np.cumsum(live[:-1]) / (60.0 * grid_hz)))
+    return beats, live
+
+
+def thin_tempo(beats, bpms, ticks_per_beat, tolerance=TEMPO_TOLERANCE, min_gap=MIN_TEMPO_GAP):
+    """
+    Grid curve -> [(abs_tick, tempo_us), ...], only the changes that matter:
+    BPM is rounded to `tolerance`, then within every `min_gap` beats only the
+    last change survives (that is the tempo the span ends up at).
+    """
+    if len(bpms) == 0:
+        return []
+    ticks = np.round(beats * ticks_per_beat).astype(np.int64)
+    bpms = np.clip(bpms, MIN_BPM, timeline.MAX_BPM)
+    if tolerance > 0:
+        bpms = np.round(bpms / tolerance) * tolerance
+
+    changed = np.concatenate(([True], bpms[1:] != bpms[:-1]))
+    ticks, bpms = ticks[changed], bpms[changed]
+
+    cell = ticks // max(1, int(ticks_per_beat * min_gap))
+    last_in_cell = np.concatenate((cell[1:] != cell[:-1], [True]))
+    ticks, bpms = ticks[last_in_cell], bpms[last_in_cell]
+    ticks[0] = 0  # the first tempo holds from the downbeat
+
+    # Dropping the middle of a -> b -> a leaves a repeat behind
+    changed = np.concatenate(([True], bpms[1:] != bpms[:-1]))
+    tempos = np.round(60e6 / bpms[changed]).astype(np.int64)
+    return list(zip(ticks[changed].tolist(), tempos.tolist()))
+
+
+def prepare_source(midi_path):
+    """
+    Source MIDI -> (ticks_per_beat, encoded MTrk chunks without set_tempo).
+    Tracks without tempo events are copied byte for byte, only the ones that
+    carry them are decoded and re-encoded. Done once per batch.
+    """
+    with open(midi_path, 'rb') as f:
+        data = f.read()
+    midi_type, ticks_per_beat, chunks = timeline.read_file_layout(data)
+    if midi_type == 2:
+        raise ValueError(f"{midi_path}: type 2 files have no single tempo map")
+    if ticks_per_beat <= 0:
+        raise ValueError(f"{midi_path}: SMPTE timing is not supported")
+
+    encoded = []
+    for i, (start, size) in enumerate(chunks):
+        events = list(timeline.iter_track(data, start, size, i))
+        out = io.BytesIO()
+        if not any(msg.type == 'set_tempo' for _, _, msg in events):
+            write_chunk(out, b'MTrk', data[start:start + size])
+        else:
+            track = mido.MidiTrack()
+            last_tick = 0
+            for abs_tick, _, msg in events:
+                if msg.type == 'set_tempo':
+                    continue
+                track.append(msg.copy(time=abs_tick - last_tick))
+                last_tick = abs_tick
+            write_track(out, track)
+        encoded.append(out.getvalue())
+    return ticks_per_beat, encoded
+
+
+def write_export(path, source, tempo_events):
+    """ Type 1 file: the new tempo track first, then the untouched source tracks """
+    ticks_per_beat, encoded = source
+    tempo_track = mido.MidiTrack()
+    last_tick = 0
+    for tick, tempo in tempo_events:
+        tempo_track.append(mido.MetaMessage('set_tempo', tempo=tempo, time=tick - last_tick))
+        last_tick = tick
+    with open(path, 'wb') as f:
+        write_chunk(f, b'MThd', struct.pack('>hhh', 1, len(encoded) + 1, ticks_per_beat))
+        write_track(f, tempo_track)
+        for chunk in encoded:
+            f.write(chunk)
+
+
+def export_session(source, csv_path, out_path, wand=None, smooth=SMOOTH_SECONDS,
+                   tolerance=TEMPO_TOLERANCE, min_gap=MIN_TEMPO_GAP):
+    """
+    One recording -> one tempo-mapped MIDI. Past the end of the recording the
+    last conducted tempo holds. Returns (set_tempo events, wall seconds spent);
+    nothing is written if the recording never played (0 events).
+    """
+    t0 = time.perf_counter()
+    times, bpms = render.load_session(csv_path, wand)
+    beats, curve = tempo_curve(times, bpms, smooth=smooth)
+    events = thin_tempo(beats, curve, source[0], tolerance, min_gap)
+    if events:
+        write_export(out_path, source, events)
+    return len(events), time.perf_counter() - t0
+
+
+def expand_sessions(paths):
+    """ CSV files as given, directories -> every track_rec_*.csv inside """
+    sessions = []
+    for path in paths:
+        if os.path.isdir(path):
+            sessions.extend(sorted(glob.glob(os.path.join(path, "track_rec_*.csv"))))
+        else:
+            sessions.append(path)
+    return sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export conducted sessions as tempo-mapped MIDI files")
+    parser.add_argument("midi", help="MIDI file the sessions were conducted with")
+    parser.add_argument("sessions", nargs="+", help="Recorded session CSV(s) or directories of them (logs/)")
+    parser.add_argument("--out-dir", default=None, help="Where to write MIDIs (default: next to each CSV)")
+    parser.add_argument("--wand", type=int, default=None, help="Wand to follow in multi-wand recordings (default: lowest wand ID)")
+    parser.add_argument("--smooth", type=float, default=SMOOTH_SECONDS, help="Moving average window (s, 0 = off)")
+    parser.add_argument("--tolerance", type=float, default=TEMPO_TOLERANCE, help="BPM change worth a set_tempo")
+    parser.add_argument("--min-gap", type=float, default=MIN_TEMPO_GAP, help="Beats between set_tempo events")
+    args = parser.parse_args()
+
+    # Decode once, reuse for the whole batch
+    t0 = time.perf_counter()
+    source = prepare_source(args.midi)
+    print(f"--- EXPORT: {args.midi} prepared in {time.perf_counter() - t0:.2f}s ---")
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    for csv_path in expand_sessions(args.sessions):
+        name = os.path.splitext(os.path.basename(csv_path))[0] + ".mid"
+        out_path = os.path.join(args.out_dir or os.path.dirname(csv_path), name)
+        n_events, spent = export_session(source, csv_path, out_path, args.wand,
+                                         args.smooth, args.tolerance, args.min_gap)
+        if n_events:
+            print(f"--- EXPORT: {out_path}  {n_events} tempo events in {spent:.2f}s ---")
+        else:
+            print(f"--- EXPORT: skipped {csv_path} (no tempo recorded) ---")
+
+
+if __name__ == "__main__":
+    main()
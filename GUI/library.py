@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+import config
+import timeline
+
+# --- SCORE LIBRARY ---
+# Every uploaded MIDI is kept under config.UPLOAD_FOLDER/library, named by
+# content hash, with one SQLite row of precomputed metadata. Playing a piece
+# from the library loads its compiled timeline instead of parsing the MIDI.
+
+LIBRARY_DIR = os.path.join(config.UPLOAD_FOLDER, 'library')
+DB_PATH = os.path.join(LIBRARY_DIR, 'index.sqlite3')
+
+_write_lock = threading.Lock()
+
+# Unpickling a big timeline holds the GIL for 100+ ms and compiling one takes
+# seconds (both audible in the MIDI scheduler), so recently played timelines
+# stay in memory - including ones still compiling, so a score uploaded again
+# mid-compile shares the running compile instead of starting another.
+TIMELINE_CACHE_SIZE = 4
+_timeline_cache = OrderedDict()     # score id -> timeline.Timeline
+_cache_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    sha1            TEXT UNIQUE NOT NULL,
+    original_name   TEXT,
+    midi_path       TEXT NOT NULL,
+    title           TEXT,
+    artist          TEXT,
+    weight          INTEGER,
+    start_bpm       REAL,
+    tempo_map       TEXT,       -- JSON [[abs_tick, tempo_us], ...]
+    duration        REAL,       -- seconds at the file's own tempo map
+    total_ticks     INTEGER,
+    ticks_per_beat  INTEGER,
+    timeline_path   TEXT,       -- pickled timeline.Timeline (NULL until compiled)
+    added           REAL
+);
+"""
+
+LIST_COLUMNS = "id, original_name, title, artist, weight, start_bpm, duration, added, timeline_path IS NOT NULL AS compiled"
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=5.0)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init():
+    os.makedirs(LIBRARY_DIR, exist_ok=True)
+    with _write_lock, _connect() as conn:
+        conn.executescript(SCHEMA)
+
+
+def store_upload(file_storage):
+    """
+    Saves an uploaded werkzeug FileStorage into the library (deduplicated by
+    content). Returns (score_id or None if new, sha1, midi_path).
+    Raises ValueError, before anything is written, if it is not a MIDI file.
+    """
+    data = file_storage.read()
+    sha1 = hashlib.sha1(data).hexdigest()
+    midi_path = os.path.join(LIBRARY_DIR, f"{sha1}.mid")
+    if not os.path.exists(midi_path):
+        try:
+            _, _, chunks = timeline.read_file_layout(data)
+        except (OSError, struct.error) as e:
+            raise ValueError(f"{file_storage.filename}: {e}")
+        if not chunks:
+            raise ValueError(f"{file_storage.filename}: no MTrk chunks")
+        with open(midi_path, 'wb') as f:
+            f.write(data)
+    with _connect() as conn:
+        row = conn.execute("SELECT id FROM scores WHERE sha1 = ?", (sha1,)).fetchone()
+    return (row["id"] if row else None), sha1, midi_path
+
+
+def add_score(sha1, original_name, midi_path, title, artist, weight, start_bpm):
+    """ First-bar metadata goes in immediately, the compiled part follows in set_compiled() """
+    with _write_lock, _connect() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO scores (sha1, original_name, midi_path, title, artist, weight, start_bpm, added) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (sha1, original_name, midi_path, title, artist, weight, start_bpm, time.time()))
+        return conn.execute("SELECT id FROM scores WHERE sha1 = ?", (sha1,)).fetchone()["id"]
+
+
+def set_compiled(score_id, tl):
+    """ Called once the timeline finished compiling: store tempo map, totals and the timeline itself """
+    timeline_path = os.path.join(LIBRARY_DIR, f"{score_id}.timeline")
+    tl.save(timeline_path)
+    with _write_lock, _connect() as conn:
+        conn.execute(
+            "UPDATE scores SET tempo_map = ?, duration = ?, total_ticks = ?, ticks_per_beat = ?, timeline_path = ? "
+            "WHERE id = ?",
+            (json.dumps(tl.tempo_map()), tl.duration, tl.total_ticks, tl.ticks_per_beat, timeline_path, score_id))
+
+
+def cache_timeline(score_id, tl):
+    with _cache_lock:
+        _timeline_cache[score_id] = tl
+        _timeline_cache.move_to_end(score_id)
+        while len(_timeline_cache) > TIMELINE_CACHE_SIZE:
+            _timeline_cache.popitem(last=False)
+
+
+def cached_timeline(score_id):
+    """ In-memory timeline (possibly still compiling) of a recently played score, or None """
+    with _cache_lock:
+        tl = _timeline_cache.get(score_id)
+        if tl is not None:
+            _timeline_cache.move_to_end(score_id)
+        return tl
+
+
+def load_timeline(score_id, timeline_path):
+    """ Compiled timeline from the in-memory LRU, else from disk (and then cached) """
+    tl = cached_timeline(score_id)
+    if tl is None:
+        tl = timeline.Timeline.load(timeline_path)
+        cache_timeline(score_id, tl)
+    return tl
+
+
+def get_score(score_id):
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM scores WHERE id = ?", (score_id,)).fetchone()
+    if row is None:
+        return None
+    score = dict(row)
+    score["tempo_map"] = json.loads(score["tempo_map"]) if score["tempo_map"] else []
+    return score
+
+
+def list_scores():
+    with _connect() as conn:
+        rows = conn.execute(f"SELECT {LIST_COLUMNS} FROM scores ORDER BY added DESC").fetchall()
+    return [dict(r) for r in rows]
+
+
+def search(query):
+    """ Case-insensitive substring match on title, artist and the uploaded file name """
+    pattern = f"%{query}%"
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT {LIST_COLUMNS} FROM scores "
+            "WHERE title LIKE ? OR artist LIKE ? OR original_name LIKE ? ORDER BY title",
+            (pattern, pattern, pattern)).fetchall()
+    return [dict(r) for r in rows]
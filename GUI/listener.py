@@ -3,162 +3,439 @@ import socket
 import time
 import csv
 import os
-from datetime import datetime  # Importing your shared state
+import sys
+import json
+import subprocess
+from datetime import datetime
 import config
+import metrics
+import ringbuffer
+import clocksync
 
 
 if not os.path.exists(config.LOG_DIR):
     os.makedirs(config.LOG_DIR)
-    
-def listen(playback_state):
+
+KIND_BY_TYPE = {name: kind for kind, name in ringbuffer.KIND_NAMES.items()}
+# Lines that must never wait behind telemetry: handled first in every serial read
+PRIORITY_PREFIXES = (b"BEAT_TRIG", b"BPM: ", b"BEAT:")
+
+
+def packet_type(decoded_line):
+    """ Classifies a wand line for metrics / routing """
+    if decoded_line.startswith("DATA,"): return "DATA"
+    if decoded_line.startswith("BEAT_TRIG"): return "BEAT_TRIG"
+    if decoded_line.startswith("BPM: "): return "BPM"
+    if decoded_line.startswith("BEAT:"): return "BEAT"
+    if decoded_line.startswith("LOG:"): return "LOG"
+    if decoded_line.startswith("Time: "): return "TIME"
+    return "OTHER"
+
+def parse_line(decoded_line):
+    """
+    Turns one wand line into a ring record: (kind, (v0, v1, v2), text, device_us).
+    device_us is the wand's sample clock (DATA,x,y,z,us / BEAT_TRIG,us), None
+    for lines (or older firmware) without one.
+    Raises ValueError on malformed numeric payloads.
+    """
+    ptype = packet_type(decoded_line)
+    kind = KIND_BY_TYPE[ptype]
+    if ptype == "DATA":
+        parts = decoded_line.split(',')
+        if len(parts) < 4:
+            raise ValueError(f"short DATA line: {decoded_line!r}")
+        device_us = int(parts[4]) if len(parts) > 4 else None
+        return kind, (float(parts[1]), float(parts[2]), float(parts[3])), b"", device_us
+    if ptype in ("BPM", "BEAT", "TIME"):
+        return kind, (float(decoded_line.split(":")[1].strip()), 0.0, 0.0), b"", None
+    if ptype == "BEAT_TRIG":
+        stamp = decoded_line[10:]
+        return kind, (0.0, 0.0, 0.0), b"", int(stamp) if stamp else None
+    return kind, (0.0, 0.0, 0.0), decoded_line.encode('utf-8', errors='ignore'), None
+
+
+# --- ROUTING ---
+class Router:
+    """ Typed fan-out: each record goes only to the rings whose consumer subscribed to its type """
+
+    def __init__(self, routes):
+        # routes: [(SampleRing, ("DATA", "LOG", ...)), ...]
+        self.by_kind = {kind: [] for kind in ringbuffer.KIND_NAMES}
+        for ring, types in routes:
+            for name in types:
+                self.by_kind[KIND_BY_TYPE[name]].append(ring)
+
+    def publish(self, kind, t, val=(0.0, 0.0, 0.0), text=b"", wand=0, rx=None):
+        for ring in self.by_kind[kind]:
+            ring.publish(kind, t, val, text, wand, rx)
+
+
+class LogLimiter:
+    """
+    Token bucket for one wand's LOG: lines. LOG_RATE lines per second pass
+    (LOG_BURST at once); during a flood only every LOG_SAMPLE_EVERY-th does.
+    """
+
+    def __init__(self, rate=config.LOG_RATE, burst=config.LOG_BURST, sample_every=config.LOG_SAMPLE_EVERY):
+        self.rate = rate
+        self.burst = burst
+        self.sample_every = sample_every
+        self.tokens = float(burst)
+        self.last = None
+        self.over = 0           # lines past the budget (every Nth of them is sampled)
+
+    def allow(self, now):
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.over += 1
+        return self.over % self.sample_every == 0
+
+
+# --- HUB STATE (pushed by app.py as "HUB:STATE <playing> <record> <replay>") ---
+def handle_hub_command(cmd, hub_state, router, cmd_sock, addr):
+    """ Commands addressed to the hub itself (never forwarded to the wand) """
+    body = cmd[4:].strip()
+    if body.startswith("STATE"):
+        fields = body.split()
+        if len(fields) == 4:
+            hub_state["is_playing"] = fields[1] == "1"
+            hub_state["record_enabled"] = fields[2] == "1"
+            hub_state["replay_active"] = fields[3] == "1"
+    elif body.startswith("INJECT "):
+        # Replay driver feeds recorded samples through the hub so the rings keep a single writer
+        try:
+            kind, val, text, _ = parse_line(body[7:])
+            router.publish(kind, time.time(), val, text)
+        except ValueError:
+            pass
+    elif body == "METRICS":
+        cmd_sock.sendto(metrics.render().encode('utf-8'), addr)
+
+
+def open_wand(wand):
+    """ Opens one wand's serial port. Non-blocking reads: the hub loop polls every port itself """
+    ser = serial.Serial(wand["port"], config.BAUD_RATE, timeout=0)
+    ser.reset_input_buffer()
+    wand["ser"] = ser
+    wand["buf"] = b""
+    wand["last_rx"] = time.time()
+    wand["streamed"] = False
+    wand["clock"].reset()  # the wand may have rebooted while the port was closed
+    # "online" flips on the first bytes, not on open: an open port is not a live wand.
+    # The backoff resets there too - opening an auto-reset board reboots it, and
+    # boot + gravity calibration keeps it silent for longer than WAND_REOPEN_AFTER
+    print(f"--- HUB: Wand {wand['id']} port {wand['port']} open ---")
+
+def mark_offline(wand, router, since):
+    """ Link lost: tell the app right away and start the reconnect stopwatch """
+    if wand["online"]:
+        wand["online"] = False
+        wand["down_since"] = since
+        router.publish(ringbuffer.KIND_STATUS, time.time(), text=b"DISCONNECTED", wand=wand["id"])
+
+def drop_wand(wand, router, reason):
+    """ Closes a failed port and schedules a re-probe with exponential backoff (ms first) """
+    if wand["ser"] is not None:
+        metrics.log_event("hub", "wand_port_error", wand=wand["id"], error=reason)
+        try:
+            wand["ser"].close()
+        except Exception:
+            pass
+    mark_offline(wand, router, time.time())
+    wand["ser"] = None
+    wand["retry_at"] = time.time() + wand["retry_delay"]
+    wand["retry_delay"] = min(wand["retry_delay"] * 2, config.WAND_RETRY_MAX)
+
+
+def listen(routes):
+    """
+    Hub process entry point: every wand's serial port -> the consumers'
+    shared-memory rings (routes: {ring name: subscribed packet types}),
+    app commands -> serial. One loop services all wands (no thread per device).
+    """
+    router = Router([(ringbuffer.SampleRing.attach(name), types) for name, types in routes.items()])
+
+    # --- METRICS ---
+    # Created here (not at import) on a fresh registry, so they are the only
+    # ones in the hub process. app.py pulls them over the command port ("HUB:METRICS").
+    metrics.reset()
+    packets_received = metrics.counter("hub_packets_received_total", "Serial lines received from the wand, by packet type")
+    serial_lines_rate = metrics.gauge("hub_serial_lines_per_second", "Serial lines read per second (1s window)")
+    wand_lines_rate = metrics.gauge("hub_wand_lines_per_second", "Serial lines read per second per wand (1s window)")
+    wand_bytes = metrics.counter("hub_wand_bytes_received_total", "Serial bytes received per wand")
+    recording_rows = metrics.counter("hub_recording_rows_written_total", "Rows written to track_rec_*.csv recordings")
+    commands_forwarded = metrics.counter("hub_commands_forwarded_total", "Commands forwarded from app.py to the wand")
+    clock_offset = metrics.gauge("hub_clock_offset_seconds", "Host - device clock offset estimate per wand")
+    clock_drift = metrics.gauge("hub_clock_drift_ppm", "Device clock rate error vs. host per wand (ppm, positive = device fast)")
+    timestamp_correction = metrics.histogram("hub_timestamp_correction_seconds",
+                                             "Receive time minus de-jittered sample time (transport delay + jitter removed)")
+    reconnect_time = metrics.histogram("hub_wand_reconnect_seconds", "Last sample before a link loss -> first sample after it",
+                                       buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+    dispatch_latency = metrics.histogram("hub_dispatch_latency_seconds", "Serial read -> published to the consumer rings, by packet type")
+    log_dropped = metrics.counter("hub_log_lines_dropped_total", "Firmware LOG: lines held back by the rate limiter, per wand")
+
     # 1. Setup UDP Socket for incoming commands (Non-blocking)
     cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     cmd_sock.bind((config.IP, config.PORT_CMD))
-    cmd_sock.setblocking(False) 
+    cmd_sock.setblocking(False)
 
-    # Socket for sending data OUT
-    out_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    hub_state = {"is_playing": False, "record_enabled": False, "replay_active": False}
 
-    print(f"--- HUB: Connecting to {config.SERIAL_PORT}... ---")
+    # One dict per wand, list index = wand ID
+    wands = [
+        {"id": i, "port": port, "ser": None, "buf": b"", "retry_at": 0, "lines": 0,
+         "last_bpm": 60.0, "last_heartbeat": 0, "last_rx": 0, "online": False, "streamed": False,
+         "down_since": None, "retry_delay": config.WAND_RETRY_MIN, "clock": clocksync.ClockSync(),
+         "logs": LogLimiter()}
+        for i, port in enumerate(config.WAND_PORTS)
+    ]
+    print(f"--- HUB: Connecting to {', '.join(config.WAND_PORTS)}... ---")
 
-    # Internal state variables
-    last_bpm = 60.0
-    
     # This variable tracks if we are CURRENTLY writing to a file
-    is_recording_active = False 
+    is_recording_active = False
     csv_file = None
     writer = None
 
     # We need to remember the previous state to detect when it *changes*
-    was_playing_previously = False 
+    was_playing_previously = False
+
+    # Lines/sec gauge bookkeeping
+    window_start = time.time()
+
+    def poll_commands():
+        """ Drains the command socket. "@<id> CMD" targets one wand, anything else goes to all """
+        while True:
+            try:
+                data, addr = cmd_sock.recvfrom(1024)
+            except BlockingIOError:
+                return
+            except Exception as e:
+                metrics.log_event("hub", "command_error", error=e)
+                return
+            cmd = data.decode('utf-8', errors='ignore').strip()
+            if cmd.startswith("HUB:"):
+                handle_hub_command(cmd, hub_state, router, cmd_sock, addr)
+                continue
+
+            targets = wands
+            if cmd.startswith("@"):
+                wand_id, _, cmd = cmd[1:].partition(" ")
+                targets = [w for w in wands if str(w["id"]) == wand_id]
+            for wand in targets:
+                if wand["ser"] is None:
+                    continue
+                commands_forwarded.inc()
+                metrics.log_event("hub", "command_forwarded", cmd=cmd, wand=wand["id"])
+                try:
+                    # Forward bytes directly to Serial (+ newline just in case)
+                    wand["ser"].write(cmd.encode('utf-8') + b'\n')
+                except Exception as e:
+                    drop_wand(wand, router, e)
 
     while True:
-        try:
-            with serial.Serial(config.SERIAL_PORT, config.BAUD_RATE, timeout=0.1) as ser:
-                print("--- HUB ACTIVE: Ready... ---")
-                ser.reset_input_buffer()
-                last_heartbeat = 0
-
-                while True:
-                    # Send Heartbeat every 2 seconds to confirm connection
-                    if time.time() - last_heartbeat > 2.0:
-                        try:
-                            sock.sendto(b"STATUS: CONNECTED", (config.IP, config.PORT_MUSIC))
-                            last_heartbeat = time.time()
-                        except: pass
-                    # --- A. Read from Arduino (Existing Logic) ---
-                    if ser.in_waiting:
-                        try:
-                            line = ser.readline()
-                            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                            sock.sendto(line, (config.IP, config.PORT_MUSIC))
-                            sock.sendto(line, (config.IP, config.PORT_VIS))
-                        except Exception:
-                            pass
-                    
-                    # --- B. Write to Arduino (NEW - No extra thread) ---
+        # --- B. Commands from app.py (No extra thread) ---
+        poll_commands()
+        now = time.time()
+
+        # --- 1. CHECK PLAYBACK STATE ---
+        is_now_playing = hub_state["is_playing"]
+        # LOGIC: Detect Track START (Rising Edge)
+        if is_now_playing and not was_playing_previously:
+            # The track JUST started. Check the record button NOW.
+            if hub_state["record_enabled"]:
+                print("[REC] Track Started & Recording Requested -> STARTING REC")
+
+                # Create File
+                timestamp_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+                filename = f"{config.LOG_DIR}/track_rec_{timestamp_str}.csv"
+                csv_file = open(filename, mode='w', newline='')
+                writer = csv.writer(csv_file)
+                writer.writerow(["Timestamp", "X", "Y", "Z", "bpm", "wand"])
+
+                is_recording_active = True
+            else:
+                print("[INFO] Track Started (Recording NOT requested)")
+                is_recording_active = False
+
+        # LOGIC: Detect Track STOP (Falling Edge)
+        elif not is_now_playing and was_playing_previously:
+            # The track JUST stopped.
+            if is_recording_active:
+                print("[REC] Track Finished -> SAVING FILE")
+                if csv_file:
+                    csv_file.close()
+                    csv_file = None
+                    writer = None
+                is_recording_active = False
+            else:
+                print("[INFO] Track Finished")
+
+        # Update history for next loop
+        was_playing_previously = is_now_playing
+
+        # Publish lines/sec once per second
+        if now - window_start >= 1.0:
+            span = now - window_start
+            serial_lines_rate.set(sum(w["lines"] for w in wands) / span)
+            for wand in wands:
+                wand_lines_rate.set(wand["lines"] / span, wand=wand["id"])
+                wand["lines"] = 0
+                if wand["clock"].offset is not None:
+                    clock_offset.set(wand["clock"].offset, wand=wand["id"])
+                    clock_drift.set(wand["clock"].drift_ppm, wand=wand["id"])
+            window_start = now
+
+        # --- A. Read from every wand ---
+        got_bytes = False
+        for wand in wands:
+            ser = wand["ser"]
+            if ser is None:
+                if now >= wand["retry_at"]:
                     try:
-                        # Check if app.py sent a command
-                        data, _ = cmd_sock.recvfrom(128) 
-                        if data:
-                            print(f"HUB: Sending command -> {data}")
-                            ser.write(data) # Forward bytes directly to Serial
-                            ser.write(b'\n') # Ensure newline just in case
-                    except BlockingIOError:
-                        # No data waiting, continue loop
-                        pass
+                        open_wand(wand)
                     except Exception as e:
-                        print(f"CMD Error: {e}")
-
-                    # Small sleep to prevent 100% CPU usage
-                    # (Serial read is fast, but this helps stability)
-                    time.sleep(0.001) 
-                    while playback_state.get('replay_active', False):
-                        time.sleep(0.1)
-                    # --- 1. CHECK PLAYBACK STATE ---
-                    # Get current status from your app
-                    is_now_playing = playback_state.get('is_playing', False) and playback_state.get('wand_enabled', False)
-                    user_wants_record = playback_state.get('record_enabled', False) # Your placeholder button
-                    # LOGIC: Detect Track START (Rising Edge)
-                    if is_now_playing and not was_playing_previously:
-                        # The track JUST started. Check the record button NOW.
-                        if user_wants_record:
-                            print("[REC] Track Started & Recording Requested -> STARTING REC")
-                            
-                            # Create File
-                            timestamp_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                            filename = f"{config.LOG_DIR}/track_rec_{timestamp_str}.csv"
-                            csv_file = open(filename, mode='w', newline='')
-                            writer = csv.writer(csv_file)
-                            writer.writerow(["Timestamp", "X", "Y", "Z", "bpm"])
-                            
-                            is_recording_active = True
-                        else:
-                            print("[INFO] Track Started (Recording NOT requested)")
-                            is_recording_active = False
-
-                    # LOGIC: Detect Track STOP (Falling Edge)
-                    elif not is_now_playing and was_playing_previously:
-                        # The track JUST stopped.
-                        if is_recording_active:
-                            print("[REC] Track Finished -> SAVING FILE")
-                            if csv_file:
-                                csv_file.close()
-                                csv_file = None
-                                writer = None
-                            is_recording_active = False
-                        else:
-                            print("[INFO] Track Finished")
-
-                    # Update history for next loop
-                    was_playing_previously = is_now_playing
-
-
-                    if ser.in_waiting:
-                        try:
-                            # one big msg with all the data needed
-                            line = ser.readline()
-                            
-                            # send everything to both visualizer and music app
-                            out_sock.sendto(line, (config.IP, config.PORT_VIS))
-                            
-
-                            out_sock.sendto(line, (config.IP, config.PORT_MUSIC))
-
-
-                            decoded_line = line.decode('utf-8', errors='ignore').strip()
-
-                            # Terminal Debug Logs from Arduino
-                            if decoded_line.startswith("LOG:"):
-                                print(f"DEBUG: {decoded_line}")
-
-                            # If we are currently in a recording session, save the data
-                            if is_recording_active and writer:
-                                if decoded_line.startswith("DATA,"):
-                                    parts = decoded_line.split(',')
-                                    if len(parts) == 4:
-                                        vals = [float(x) for x in parts[1:]]
-                                        writer.writerow([time.time()] + vals + [last_bpm])
-                                
-                            # Update BPM (Global)
-                            if decoded_line.startswith("BPM: "):
-                                try:
-                                    last_bpm = float(decoded_line.split(":")[1].strip())
-                                except: pass
-
-                        except Exception as e:
-                            print(f"Packet Error: {e}")
-                    else:
-                        time.sleep(0.001) 
-
-        except Exception as e:
-            print(f"Hub Error: {e}")
+                        drop_wand(wand, router, e)
+                continue
+
+            try:
+                waiting = ser.in_waiting
+                chunk = ser.read(waiting) if waiting else b""
+            except Exception as e:
+                drop_wand(wand, router, e)
+                continue
+
+            if not chunk:
+                # Sample-gap detection: the wand streams constantly, silence = link lost
+                silent = now - wand["last_rx"]
+                if wand["online"] and silent > config.WAND_GAP_TIMEOUT:
+                    mark_offline(wand, router, wand["last_rx"])
+                elif not wand["online"] and wand["streamed"] and silent > config.WAND_REOPEN_AFTER:
+                    # Port streamed, then died (e.g. USB re-enumerated): re-probe it.
+                    # A freshly opened port that never sent anything is left alone -
+                    # the wand is still booting / calibrating, reopening would reset it again
+                    drop_wand(wand, router, "no data")
+                continue
+
+            got_bytes = True
+            wand["last_rx"] = now
+            if not wand["streamed"]:
+                wand["streamed"] = True
+                wand["retry_delay"] = config.WAND_RETRY_MIN  # first data, not open, proves the link
+            wand_bytes.inc(len(chunk), wand=wand["id"])
+            if not wand["online"]:
+                wand["online"] = True
+                router.publish(ringbuffer.KIND_STATUS, now, text=b"CONNECTED", wand=wand["id"])
+                wand["last_heartbeat"] = now
+                if wand["down_since"] is not None:
+                    took = now - wand["down_since"]
+                    reconnect_time.observe(took)
+                    print(f"--- HUB: Wand {wand['id']} reconnected in {took * 1000:.0f} ms ---")
+                    wand["down_since"] = None
+                else:
+                    print(f"--- HUB ACTIVE: Wand {wand['id']} on {wand['port']} streaming ---")
+
+            # Heartbeat so the app knows the link is alive even without BPM lines
+            if now - wand["last_heartbeat"] > config.WAND_HEARTBEAT:
+                router.publish(ringbuffer.KIND_STATUS, now, text=b"CONNECTED", wand=wand["id"])
+                wand["last_heartbeat"] = now
+
+            # During replay the CSV drives everything: drain the port, publish nothing
+            if hub_state["replay_active"]:
+                wand["buf"] = b""
+                continue
+
+            # Split on newlines, keep the unfinished tail for the next read
+            *lines, wand["buf"] = (wand["buf"] + chunk).split(b"\n")
+            rx_time = time.time()
+            wand["lines"] += len(lines)
+
+            # Timing-critical lines jump the queue: a burst of samples or a LOG
+            # flood in the same read never delays a beat
+            urgent = [line for line in lines if line.startswith(PRIORITY_PREFIXES)]
+            if urgent:
+                lines = urgent + [line for line in lines if not line.startswith(PRIORITY_PREFIXES)]
+
+            for line in lines:
+                try:
+                    # LOG floods are thinned before any decoding work
+                    if line.startswith(b"LOG:") and not wand["logs"].allow(rx_time):
+                        packets_received.inc(type="LOG")
+                        log_dropped.inc(wand=wand["id"])
+                        continue
+                    decoded_line = line.decode('utf-8', errors='ignore').strip()
+                    if not decoded_line:
+                        continue
+                    kind, val, text, device_us = parse_line(decoded_line)
+                    ptype = ringbuffer.KIND_NAMES[kind]
+                    packets_received.inc(type=ptype)
+
+                    # Sample time on the host clock, without USB / polling jitter
+                    sample_time = rx_time
+                    if device_us is not None:
+                        sample_time = wand["clock"].to_host(device_us, rx_time)
+                        timestamp_correction.observe(rx_time - sample_time)
+
+                    # Only the consumers subscribed to this type get it
+                    router.publish(kind, sample_time, val, text, wand=wand["id"], rx=rx_time)
+                    dispatch_latency.observe(time.time() - rx_time, type=ptype)
+
+                    # Terminal Debug Logs from Arduino
+                    if kind == ringbuffer.KIND_LOG:
+                        metrics.log_event("wand", "log", line=decoded_line, wand=wand["id"])
+
+                    # If we are currently in a recording session, save the data
+                    if is_recording_active and writer and kind == ringbuffer.KIND_DATA:
+                        writer.writerow([sample_time, *val, wand["last_bpm"], wand["id"]])
+                        recording_rows.inc()
+
+                    # Update BPM (per wand)
+                    if kind == ringbuffer.KIND_BPM:
+                        wand["last_bpm"] = val[0]
+
+                except Exception as e:
+                    metrics.log_event("hub", "packet_error", error=e, wand=wand["id"])
+
+        if not got_bytes:
+            time.sleep(0.001)
+
+
+# --- SUPERVISOR (runs as a thread inside app.py) ---
+def supervise(routes, stop_event):
+    """ Keeps exactly one hub process alive, restarting it with backoff if it dies """
+    hub_restarts = metrics.counter("supervisor_hub_restarts_total", "Times the supervisor had to restart the hub process")
+    delay = config.HUB_RESTART_DELAY
+    while not stop_event.is_set():
+        # A fresh interpreter running this file (like trace.py): a forked child inherits
+        # the locks app.py's threads held, and multiprocessing's spawn re-imports
+        # app.py as __mp_main__ (library, Flask app, sockets) in the hub
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), json.dumps(routes)])
+        started = time.time()
+        print(f"--- SUPERVISOR: Hub process started (pid {proc.pid}) ---")
+
+        while proc.poll() is None and not stop_event.is_set():
+            stop_event.wait(0.5)
+
+        if stop_event.is_set():
+            proc.terminate()
             try:
-                sock.sendto(b"STATUS: DISCONNECTED", (config.IP, config.PORT_MUSIC))
-            except: pass
-            if csv_file:
-                csv_file.close()
-            time.sleep(2)
+                proc.wait(1.0)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            return
 
+        hub_restarts.inc()
+        # A hub that ran for a while gets a fast restart; a crash loop backs off
+        if time.time() - started > 10.0:
+            delay = config.HUB_RESTART_DELAY
+        print(f"--- SUPERVISOR: Hub died (exit {proc.returncode}), restarting in {delay:.1f}s ---")
+        stop_event.wait(delay)
+        delay = min(delay * 2, 10.0)
 
 
+if __name__ == "__main__":
+    # Hub process, started by supervise(): routes as JSON {ring name: [types]}
+    listen(json.loads(sys.argv[1]))
@@ -0,0 +1,181 @@
+import threading
+import time
+
+# --- IN-PROCESS METRICS REGISTRY ---
+# Tiny Prometheus-style registry (counters, gauges, histograms) shared by the
+# app, the hub and the visualizer. Everything is guarded by one lock; updates
+# are a dict lookup plus an add, cheap enough for the per-packet hot loops.
+
+_lock = threading.Lock()
+_registry = {}
+
+# Default buckets (seconds) - tuned for MIDI / packet timing, 100us .. 1s
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value, quote=True):
+    """ Text format escaping: backslash, newline, and (in label values) the double quote """
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_labels(key, extra=None):
+    items = list(key)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = _label_key(labels)
+        with _lock:
+            return self.values.get(key, 0)
+
+    def samples(self):
+        return [(self.name, key, None, val) for key, val in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            row = self.values.get(key)
+            if row is None:
+                row = [0] * (len(self.buckets) + 2)
+                self.values[key] = row
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def summary(self, **labels):
+        """ Returns (count, mean) for a label set - handy for benchmarks """
+        key = _label_key(labels)
+        with _lock:
+            row = self.values.get(key)
+            if not row or row[-1] == 0:
+                return 0, 0.0
+            return row[-1], row[-2] / row[-1]
+
+    def samples(self):
+        out = []
+        for key, row in self.values.items():
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += row[i]
+                out.append((self.name + "_bucket", key, ("le", bound), cumulative))
+            out.append((self.name + "_bucket", key, ("le", "+Inf"), row[-1]))
+            out.append((self.name + "_sum", key, None, row[-2]))
+            out.append((self.name + "_count", key, None, row[-1]))
+        return out
+
+
+def _get_or_create(cls, name, help_text, **kwargs):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, help_text, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name, help_text):
+    return _get_or_create(Counter, name, help_text)
+
+
+def gauge(name, help_text):
+    return _get_or_create(Gauge, name, help_text)
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, help_text, buckets=buckets)
+
+
+def reset():
+    """
+    Empties the registry in a child process. A forked hub (the benchmarks
+    run listen() that way) copies the parent's metrics; they must not show
+    up in its HUB:METRICS reply. Replaces the lock too, in case it was held
+    when the process was forked.
+    """
+    global _lock, _registry, _log_last, _log_suppressed
+    _lock = threading.Lock()
+    _registry = {}
+    _log_last = {}
+    _log_suppressed = {}
+
+
+def render():
+    """ Returns the whole registry in the Prometheus text exposition format """
+    lines = []
+    with _lock:
+        for name in sorted(_registry):
+            metric = _registry[name]
+            lines.append(f"# HELP {name} {_escape(metric.help_text, quote=False)}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample_name, key, extra, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- RATE-LIMITED STRUCTURED LOGGING ---
+# Replaces print() in the hot loops: each (source, event) pair prints at most
+# once per interval, and the line says how many repeats were swallowed.
+_log_last = {}
+_log_suppressed = {}
+
+
+def log_event(source, event, interval=1.0, **fields):
+    key = (source, event)
+    now = time.monotonic()
+    with _lock:
+        if now - _log_last.get(key, -interval) < interval:
+            _log_suppressed[key] = _log_suppressed.get(key, 0) + 1
+            return
+        _log_last[key] = now
+        suppressed = _log_suppressed.pop(key, 0)
+
+    parts = [f"[{source}] {event}"]
+    parts += [f"{k}={v}" for k, v in fields.items()]
+    if suppressed:
+        parts.append(f"(+{suppressed} suppressed)")
+    print(" ".join(parts))
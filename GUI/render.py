@@ -0,0 +1,237 @@
+import argparse
+import os
+import time
+import wave
+import numpy as np
+import timeline
+
+# --- OFFLINE SESSION RENDER ---
+# Replays a recorded session (logs/track_rec_*.csv) against a MIDI file with
+# the same tempo rules as the live app, but on a virtual clock, then renders
+# the resulting notes to a WAV with a vectorized wavetable synth.
+#
+#   python render.py song.mid logs/track_rec_A.csv logs/track_rec_B.csv --out-dir renders
+
+SAMPLE_RATE = 44100
+TABLE_SIZE = 2048
+BLOCK_SAMPLES = 1 << 21     # samples synthesized per numpy batch (bounds memory)
+ATTACK = 0.005              # seconds
+DECAY = 1.2                 # seconds for the sustain to fall by 1/e
+RELEASE = 0.08              # seconds after note off
+DRUM_HOLD = 0.12            # percussion (channel 10) ignores note length
+DRUM_CHANNEL = 9
+
+
+def load_session(csv_path, wand=None):
+    """
+    Recording -> (seconds since first row, bpm) arrays for ONE wand.
+    Multi-wand logs interleave every wand's rows: `wand` picks one, default
+    (or a wand that is not in the file) is the lowest wand ID recorded.
+    Recordings from before the wand column are single-wand; `wand` is ignored.
+    """
+    with open(csv_path) as f:
+        header = f.readline().strip().split(',')
+    has_wand = "wand" in header
+    cols = (0, 4, header.index("wand")) if has_wand else (0, 4)
+    data = np.loadtxt(csv_path, delimiter=',', skiprows=1, usecols=cols, ndmin=2)
+    if has_wand and len(data):
+        recorded = np.unique(data[:, 2])
+        if wand is None or wand not in recorded:
+            if wand is not None:
+                print(f"--- RENDER: wand {wand} not in {csv_path}, using wand {int(recorded[0])} ---")
+            wand = recorded[0]
+        data = data[data[:, 2] == wand]
+    if len(data) == 0:
+        return np.zeros(0), np.zeros(0)
+    times = data[:, 0] - data[0, 0]
+    bpms = np.clip(data[:, 1], 0.0, timeline.MAX_BPM)  # == timeline.clamp_bpm, vectorized
+    return times, bpms
+
+
+def schedule_session(tl, times, bpms):
+    """
+    Mirrors replay_driver + playback_engine on a virtual clock.
+    - the BPM of the latest CSV row applies (apply_bpm_logic: 0 = pause)
+    - each MIDI delta is converted with the BPM read when the wait starts
+    - while paused, all notes are cut and the song position holds
+    - playback stops when the recording runs out (replay_driver ends)
+    Returns (events, end_time): events = [(wall_seconds, msg), ...]
+    """
+    if len(times) == 0:
+        return [], 0.0
+    end_time = float(times[-1])
+    tpb = tl.ticks_per_beat
+
+    # For every row: index of the next row with bpm > 0 (pause exit), -1 if none
+    nonzero = np.nonzero(bpms > 0)[0]
+    pos = np.searchsorted(nonzero, np.arange(len(bpms)))
+    next_playing = np.where(pos < len(nonzero), nonzero[np.minimum(pos, len(nonzero) - 1)], -1)
+
+    events = []
+    row = 0
+    t = 0.0
+    n_rows = len(times)
+    for msg in tl.messages:
+        # Advance to the CSV row that is live at time t
+        while row + 1 < n_rows and times[row + 1] <= t:
+            row += 1
+        if t >= end_time:
+            break
+
+        if bpms[row] <= 0:
+            # Pause: engine sends All Notes Off, then waits for a BPM again
+            events.append((t, None))
+            resume = next_playing[row]
+            if resume < 0:
+                break
+            row = resume
+            t = float(times[row])
+
+        if msg.time > 0:
+            t += msg.time * 60.0 / (bpms[row] * tpb)
+        if not msg.is_meta:
+            events.append((t, msg))
+    return events, min(t, end_time)
+
+
+def collect_notes(events, end_time):
+    """ Note on/off pairs -> structured array (start, end, note, velocity, channel) """
+    sounding = {}
+    notes = []
+    for t, msg in events:
+        if msg is None:
+            for (ch, note), (start, vel) in sounding.items():
+                notes.append((start, t, note, vel, ch))
+            sounding.clear()
+            continue
+        if msg.type == 'note_on' and msg.velocity > 0:
+            key = (msg.channel, msg.note)
+            if key in sounding:
+                start, vel = sounding[key]
+                notes.append((start, t, msg.note, vel, msg.channel))
+            sounding[key] = (t, msg.velocity)
+        elif msg.type in ('note_off', 'note_on'):
+            key = (msg.channel, msg.note)
+            if key in sounding:
+                start, vel = sounding.pop(key)
+                notes.append((start, t, msg.note, vel, msg.channel))
+    for (ch, note), (start, vel) in sounding.items():
+        notes.append((start, end_time, note, vel, ch))
+
+    dtype = [('start', 'f8'), ('end', 'f8'), ('note', 'i4'), ('velocity', 'i4'), ('channel', 'i4')]
+    return np.array(notes, dtype=dtype)
+
+
+def _wavetables():
+    phase = np.arange(TABLE_SIZE) / TABLE_SIZE
+    # Soft organ-ish tone: fundamental + two harmonics
+    tone = (np.sin(2 * np.pi * phase) + 0.4 * np.sin(4 * np.pi * phase) + 0.15 * np.sin(6 * np.pi * phase)) / 1.55
+    noise = np.random.default_rng(0).uniform(-1.0, 1.0, TABLE_SIZE)
+    return tone.astype(np.float32), noise.astype(np.float32)
+
+
+def synthesize(notes, total_seconds, sample_rate=SAMPLE_RATE):
+    """ Renders all notes into one float32 buffer, a batch of notes per numpy pass """
+    total = int(total_seconds * sample_rate) + int(RELEASE * sample_rate) + 1
+    out = np.zeros(total, dtype=np.float32)
+    if len(notes) == 0:
+        return out
+    tone, noise = _wavetables()
+
+    is_drum = notes['channel'] == DRUM_CHANNEL
+    starts = (notes['start'] * sample_rate).astype(np.int64)
+    hold_sec = np.where(is_drum, DRUM_HOLD, np.maximum(notes['end'] - notes['start'], 0.0))
+    holds = (hold_sec * sample_rate).astype(np.int64)
+    lengths = np.minimum(holds + int(RELEASE * sample_rate), total - starts).clip(min=0)
+    freqs = 440.0 * 2.0 ** ((notes['note'] - 69) / 12.0)
+    # Drums: noise read at a fixed rate (pitch barely matters for a click/hiss)
+    step = np.where(is_drum, 0.37 * TABLE_SIZE, freqs * TABLE_SIZE / sample_rate)
+    amps = (notes['velocity'] / 127.0 * 0.15).astype(np.float32)
+
+    # Envelope lookup tables indexed by sample offset (no exp() per sample)
+    sec = np.arange(int(lengths.max()) + 1, dtype=np.float32) / sample_rate
+    env_table = np.minimum(1.0, sec / ATTACK) * np.exp(-sec / DECAY)
+    release_table = np.exp(-sec / (RELEASE / 5)).astype(np.float32)
+
+    order = np.argsort(starts, kind='stable')
+    cum = np.cumsum(lengths[order])
+    batch_start = 0
+    while batch_start < len(order):
+        base_len = cum[batch_start - 1] if batch_start else 0
+        batch_end = int(np.searchsorted(cum, base_len + BLOCK_SAMPLES, side='right'))
+        batch_end = max(batch_end, batch_start + 1)
+        sel = order[batch_start:batch_end]
+        batch_start = batch_end
+
+        L = lengths[sel]
+        n = int(L.sum())
+        if n == 0:
+            continue
+        # Offset of every sample inside its own note
+        first = np.repeat(np.cumsum(L) - L, L)
+        offs = np.arange(n, dtype=np.int64) - first
+
+        idx = (offs * np.repeat(step[sel], L)).astype(np.int64) % TABLE_SIZE
+        wave_vals = np.where(np.repeat(is_drum[sel], L), noise[idx], tone[idx])
+
+        env = env_table[offs]
+        hold = np.repeat(holds[sel], L)
+        released = offs > hold
+        env[released] *= release_table[offs[released] - hold[released]]
+
+        vals = wave_vals * env * np.repeat(amps[sel], L)
+        positions = np.repeat(starts[sel], L) + offs
+        lo = int(positions.min())
+        mixed = np.bincount(positions - lo, weights=vals)
+        out[lo:lo + len(mixed)] += mixed.astype(np.float32)
+    return out
+
+
+def write_wav(path, samples, sample_rate=SAMPLE_RATE):
+    peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+    if peak > 0.99:
+        samples = samples * (0.99 / peak)
+    pcm = (samples * 32767).astype('<i2')
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm.tobytes())
+
+
+def render_session(tl, csv_path, wav_path, wand=None, sample_rate=SAMPLE_RATE):
+    """ One recording -> one WAV. Returns (audio seconds, wall seconds spent) """
+    t0 = time.perf_counter()
+    times, bpms = load_session(csv_path, wand)
+    events, end_time = schedule_session(tl, times, bpms)
+    notes = collect_notes(events, end_time)
+    audio = synthesize(notes, end_time, sample_rate)
+    write_wav(wav_path, audio, sample_rate)
+    return len(audio) / sample_rate, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render conducted sessions to WAV, faster than real time")
+    parser.add_argument("midi", help="MIDI file the sessions were conducted with")
+    parser.add_argument("sessions", nargs="+", help="Recorded session CSV(s) (logs/track_rec_*.csv)")
+    parser.add_argument("--out-dir", default=None, help="Where to write WAVs (default: next to each CSV)")
+    parser.add_argument("--wand", type=int, default=None, help="Wand to follow in multi-wand recordings (default: lowest wand ID)")
+    parser.add_argument("--rate", type=int, default=SAMPLE_RATE, help="Sample rate (Hz)")
+    args = parser.parse_args()
+
+    # Compile once, reuse for the whole batch
+    tl = timeline.compile_streaming(args.midi)
+    tl.wait_complete()
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    for csv_path in args.sessions:
+        name = os.path.splitext(os.path.basename(csv_path))[0] + ".wav"
+        wav_path = os.path.join(args.out_dir or os.path.dirname(csv_path), name)
+        audio_sec, spent = render_session(tl, csv_path, wav_path, args.wand, args.rate)
+        speed = audio_sec / spent if spent > 0 else float('inf')
+        print(f"--- RENDER: {wav_path}  {audio_sec:.1f}s audio in {spent:.2f}s ({speed:.0f}x real time) ---")
+
+
+if __name__ == "__main__":
+    main()
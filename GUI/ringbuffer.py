@@ -0,0 +1,163 @@
+import sys
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# --- SHARED-MEMORY SAMPLE RING ---
+# The hub process is the ONLY writer. app.py and trace.py attach by name and
+# read numpy views straight out of shared memory (no copies, no locks).
+#
+# Layout:  [header: 8 x uint64][slot 0][slot 1]...[slot capacity-1]
+#   header[0] = head (total records ever published)
+#   header[1] = capacity
+#
+# Every slot carries its own sequence number (record index + 1). The writer
+# fills the payload first and stamps the sequence last, so a reader can tell
+# a finished slot from one that is being overwritten.
+
+# Record kinds (one per wand line type)
+KIND_DATA = 1
+KIND_BPM = 2
+KIND_BEAT = 3
+KIND_BEAT_TRIG = 4
+KIND_LOG = 5
+KIND_TIME = 6
+KIND_STATUS = 7
+KIND_OTHER = 8
+
+KIND_NAMES = {
+    KIND_DATA: "DATA",
+    KIND_BPM: "BPM",
+    KIND_BEAT: "BEAT",
+    KIND_BEAT_TRIG: "BEAT_TRIG",
+    KIND_LOG: "LOG",
+    KIND_TIME: "TIME",
+    KIND_STATUS: "STATUS",
+    KIND_OTHER: "OTHER",
+}
+
+SLOT_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('kind', 'u1'),
+    ('wand', 'u1'),        # wand ID (index into config.WAND_PORTS)
+    ('t', '<f8'),          # sample time on the host clock (de-jittered when the wand stamps it)
+    ('rx', '<f8'),         # when the hub read the line (delivery latency = consumer now - rx)
+    ('val', '<f4', (3,)),  # DATA: x,y,z | BPM/BEAT/TIME: val[0]
+    ('text', 'S64'),       # LOG / STATUS / OTHER payload
+], align=True)
+
+HEADER_WORDS = 8
+HEADER_BYTES = HEADER_WORDS * 8
+DEFAULT_CAPACITY = 4096
+
+
+class SampleRing:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_WORDS,), dtype='<u8', buffer=shm.buf, offset=0)
+        self.capacity = int(self.header[1])
+        self.slots = np.ndarray((self.capacity,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=HEADER_BYTES)
+
+    @classmethod
+    def create(cls, name, capacity=DEFAULT_CAPACITY):
+        """ Creates (or re-creates) the ring. Called once by app.py, which owns it """
+        size = HEADER_BYTES + capacity * SLOT_DTYPE.itemsize
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_WORDS,), dtype='<u8', buffer=shm.buf, offset=0)
+        header[:] = 0
+        header[1] = capacity
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name, untrack=False):
+        """
+        Attaches to an existing ring. Pass untrack=True from processes that
+        were NOT started by multiprocessing (e.g. trace.py), otherwise their
+        resource tracker unlinks the segment when they exit.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack and sys.platform != "win32":
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def head(self):
+        return int(self.header[0])
+
+    def publish(self, kind, t, val=(0.0, 0.0, 0.0), text=b"", wand=0, rx=None):
+        """ Single-writer append. Payload first, sequence stamp second, head last """
+        n = int(self.header[0])
+        slot = self.slots[n % self.capacity]
+        slot['seq'] = 0
+        slot['kind'] = kind
+        slot['wand'] = wand
+        slot['t'] = t
+        slot['rx'] = t if rx is None else rx
+        slot['val'] = val
+        slot['text'] = text[:64]
+        slot['seq'] = n + 1
+        self.header[0] = n + 1
+
+    def close(self):
+        del self.header, self.slots
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class RingReader:
+    """ Per-consumer cursor. Each reader sees every record exactly once (or counts it as dropped) """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.cursor = ring.head
+        self.dropped = 0
+
+    def skip(self):
+        """ Jumps to the newest record without reading (or counting) the backlog """
+        self.cursor = self.ring.head
+
+    def poll(self, max_items=None):
+        """
+        Returns a list of (at most two) numpy views over the new records.
+        Views point straight into shared memory - consume them before the
+        next poll() call.
+        """
+        ring = self.ring
+        head = ring.head
+        if head == self.cursor:
+            return []
+
+        # Lapped by the writer: skip to the oldest record that is still intact
+        if head - self.cursor > ring.capacity:
+            skip_to = head - ring.capacity + 1
+            self.dropped += skip_to - self.cursor
+            self.cursor = skip_to
+
+        end = head if max_items is None else min(head, self.cursor + max_items)
+        start_idx = self.cursor % ring.capacity
+        end_idx = end % ring.capacity
+        if end_idx > start_idx:
+            views = [ring.slots[start_idx:end_idx]]
+        else:
+            views = [ring.slots[start_idx:], ring.slots[:end_idx]]
+
+        # Drop the (rare) records the writer overwrote while we were slicing
+        first_seq = int(views[0]['seq'][0]) if len(views[0]) else self.cursor + 1
+        if first_seq != self.cursor + 1:
+            self.dropped += end - self.cursor
+            self.cursor = end
+            return []
+
+        self.cursor = end
+        return [v for v in views if len(v)]
@@ -0,0 +1,324 @@
+import bisect
+import heapq
+import io
+import pickle
+import struct
+import threading
+import mido
+from mido.midifiles.midifiles import read_message, read_meta_message, read_sysex, read_variable_int, read_byte
+
+# --- STREAMING MIDI TIMELINE ---
+# mido.MidiFile parses every track completely before you get a single message.
+# Here each MTrk chunk is decoded lazily by its own generator and the tracks
+# are merged on the fly, so the playback engine can start after the first bar
+# while the rest of the file keeps compiling in a background thread.
+
+DEFAULT_TEMPO = 500000  # 120 BPM, MIDI default
+MAX_BPM = 240.0
+
+
+def clamp_bpm(raw_bpm):
+    """ Same limits everywhere (wand, replay, /set_bpm, offline render): 0 = stopped, max 240 """
+    if raw_bpm > MAX_BPM: raw_bpm = MAX_BPM
+    if raw_bpm < 0: raw_bpm = 0.0
+    return raw_bpm
+
+
+def read_file_layout(data):
+    """ Parses MThd and locates every MTrk chunk. Returns (type, ticks_per_beat, [(start, size), ...]) """
+    if data[:4] != b'MThd':
+        raise OSError('MThd not found. Probably not a MIDI file')
+    header_size = struct.unpack('>L', data[4:8])[0]
+    midi_type, n_tracks, ticks_per_beat = struct.unpack('>hhh', data[8:14])
+
+    chunks = []
+    pos = 8 + header_size
+    while pos + 8 <= len(data) and len(chunks) < n_tracks:
+        name = data[pos:pos + 4]
+        size = struct.unpack('>L', data[pos + 4:pos + 8])[0]
+        if name == b'MTrk':
+            chunks.append((pos + 8, size))
+        pos += 8 + size
+    return midi_type, ticks_per_beat, chunks
+
+
+def iter_track(data, start, size, track_index):
+    """ Yields (abs_tick, track_index, msg) for one MTrk chunk, decoding on demand """
+    infile = io.BytesIO(data[start:start + size])
+    last_status = None
+    abs_tick = 0
+    while infile.tell() < size:
+        delta = read_variable_int(infile)
+        abs_tick += delta
+        status_byte = read_byte(infile)
+
+        if status_byte < 0x80:
+            if last_status is None:
+                raise OSError('running status without last_status')
+            peek_data = [status_byte]
+            status_byte = last_status
+        else:
+            if status_byte != 0xff:
+                # Meta messages don't set running status.
+                last_status = status_byte
+            peek_data = []
+
+        if status_byte == 0xff:
+            msg = read_meta_message(infile, delta)
+        elif status_byte in (0xf0, 0xf7):
+            msg = read_sysex(infile, delta, clip=True)
+        else:
+            msg = read_message(infile, status_byte, peek_data, delta, clip=True)
+        yield abs_tick, track_index, msg
+
+
+class Timeline:
+    """
+    Merged, delta-timed message list that grows while the file compiles.
+    Same message order as mido.merge_tracks (ties go to the earlier track).
+    """
+
+    def __init__(self, ticks_per_beat):
+        self.ticks_per_beat = ticks_per_beat
+        self.messages = []      # delta-time messages, ready for play_stream()
+        self.ticks = []         # absolute tick of each message
+        self.total_ticks = 0
+        self.first_bar_ticks = ticks_per_beat * 4
+        self.duration = 0.0     # seconds at the file's own tempo map (== MidiFile.length)
+        self.complete = False
+        self.error = None
+        self.cond = threading.Condition()
+
+        # --- TEMPO INDEX ---
+        # One segment per tempo: (seconds elapsed at its start tick, tempo);
+        # seg_ticks holds the start ticks for the lookup. Built while compiling,
+        # so tick -> seconds never rescans the messages.
+        # Readers (/progress, the engine) don't take cond: an entry is written as
+        # one tuple and its tick is appended last, so an index found in seg_ticks
+        # always has its whole entry. Same for the bar map.
+        self.seg_ticks = [0]
+        self.segments = [(0.0, DEFAULT_TEMPO)]
+        self._seg_hint = 0
+
+        # --- BAR MAP ---
+        # One entry per meter: (bar number at its start tick, numerator,
+        # denominator), start ticks in sig_ticks. Bar:beat of any tick is a
+        # lookup plus one division.
+        self.sig_ticks = [0]
+        self.meters = [(0, 4, 4)]
+        self._sig_hint = 0
+
+    def _add_tempo(self, abs_tick, tempo):
+        if abs_tick == self.seg_ticks[-1]:
+            self.segments[-1] = (self.segments[-1][0], tempo)
+            return
+        self.segments.append((self.seconds_at(abs_tick), tempo))
+        self.seg_ticks.append(abs_tick)
+
+    def bar_ticks(self, i):
+        """ Length of one bar (ticks) in meter entry i """
+        _, numerator, denominator = self.meters[i]
+        return self.ticks_per_beat * 4 * numerator // denominator
+
+    def _add_meter(self, abs_tick, numerator, denominator):
+        if abs_tick == self.sig_ticks[-1]:
+            self.meters[-1] = (self.meters[-1][0], numerator, denominator)
+            return
+        # A change in the middle of a bar starts a new bar (rounds up)
+        bar_len = self.bar_ticks(len(self.sig_ticks) - 1)
+        last_bar, last_num, last_den = self.meters[-1]
+        bars = last_bar + -(-(abs_tick - self.sig_ticks[-1]) // bar_len)
+        if (numerator, denominator) == (last_num, last_den):
+            return
+        self.meters.append((bars, numerator, denominator))
+        self.sig_ticks.append(abs_tick)
+
+    def extend(self, batch, end=False):
+        with self.cond:
+            for abs_tick, msg in batch:
+                self.ticks.append(abs_tick)
+                self.messages.append(msg)
+                if msg.type == 'set_tempo':
+                    self._add_tempo(abs_tick, msg.tempo)
+                elif msg.type == 'time_signature':
+                    self._add_meter(abs_tick, msg.numerator, msg.denominator)
+            if batch:
+                self.total_ticks = batch[-1][0]
+                self.duration = self.seconds_at(self.total_ticks)
+            self.complete = end
+            self.cond.notify_all()
+
+    # --- POSITION LOOKUP ---
+    @staticmethod
+    def _locate(starts, hint, tick):
+        """ Index of the run in `starts` containing `tick`. O(1) while playback moves forward, bisect otherwise """
+        if hint < len(starts) and starts[hint] <= tick:
+            if hint + 1 == len(starts) or tick < starts[hint + 1]:
+                return hint
+            if hint + 2 == len(starts) or tick < starts[hint + 2]:
+                return hint + 1
+        return max(0, bisect.bisect_right(starts, tick) - 1)
+
+    def segment_at(self, tick):
+        """ Tempo segment containing `tick` """
+        self._seg_hint = self._locate(self.seg_ticks, self._seg_hint, tick)
+        return self._seg_hint
+
+    def meter_at(self, tick):
+        """ Bar map entry containing `tick` """
+        self._sig_hint = self._locate(self.sig_ticks, self._sig_hint, tick)
+        return self._sig_hint
+
+    def bar_beat_at(self, tick):
+        """ (bar, beat, numerator, denominator) at an absolute tick; bar and beat count from 0 """
+        i = self.meter_at(tick)
+        bar, numerator, denominator = self.meters[i]
+        bar_len = self.ticks_per_beat * 4 * numerator // denominator
+        offset = tick - self.sig_ticks[i]
+        beat_len = self.ticks_per_beat * 4 // denominator
+        return bar + offset // bar_len, (offset % bar_len) // beat_len, numerator, denominator
+
+    def next_meter_change(self, tick):
+        """ (abs_tick, numerator, denominator) of the first meter change after `tick`, or None (so far) """
+        i = self.meter_at(tick) + 1
+        if i < len(self.sig_ticks):
+            _, numerator, denominator = self.meters[i]
+            return self.sig_ticks[i], numerator, denominator
+        return None
+
+    def seconds_at(self, tick):
+        """ Score time (file tempo map) at an absolute tick """
+        i = self.segment_at(tick)
+        seconds, tempo = self.segments[i]
+        return seconds + (tick - self.seg_ticks[i]) * tempo / (self.ticks_per_beat * 1e6)
+
+    def remaining_seconds(self, tick, live_bpm, follow_tempo_map):
+        """
+        Wall-clock time left if playback keeps going at live_bpm.
+        follow_tempo_map=True (auto-tempo mode): live_bpm only holds until the
+        next set_tempo, after that the file's own tempo takes over.
+        Returns None while stopped (live_bpm <= 0).
+        """
+        if live_bpm <= 0:
+            return None
+        seconds_per_tick = 60.0 / (live_bpm * self.ticks_per_beat)
+        if not follow_tempo_map:
+            return max(0, self.total_ticks - tick) * seconds_per_tick
+        i = self.segment_at(tick)
+        seg_ticks = self.seg_ticks
+        if i + 1 >= len(seg_ticks):
+            return max(0, self.total_ticks - tick) * seconds_per_tick
+        next_tick = seg_ticks[i + 1]
+        return (next_tick - tick) * seconds_per_tick + max(0.0, self.duration - self.segments[i + 1][0])
+
+    def iter_messages(self):
+        """ Yields messages in order, blocking when playback catches up with the compiler """
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.messages) and not self.complete:
+                    self.cond.wait(0.1)
+                if i >= len(self.messages):
+                    return
+                available = self.messages[i:]
+            for msg in available:
+                yield msg
+            i += len(available)
+
+    def wait_complete(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.complete, timeout)
+        return self.complete
+
+    def first_events(self, tick_limit):
+        """ Messages with abs tick <= tick_limit (metadata lives here) """
+        with self.cond:
+            return self.messages[:bisect.bisect_right(self.ticks, tick_limit)]
+
+    def tempo_map(self):
+        """ [(abs_tick, tempo_us_per_beat), ...] for every set_tempo compiled so far """
+        with self.cond:
+            return [(t, m.tempo) for t, m in zip(self.ticks, self.messages) if m.type == 'set_tempo']
+
+    def save(self, path):
+        """ Stores a COMPLETE timeline so the library can skip parsing next time """
+        with open(path, 'wb') as f:
+            pickle.dump((self.ticks_per_beat, self.ticks, self.messages, self.duration, self.first_bar_ticks), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            ticks_per_beat, ticks, messages, duration, first_bar_ticks = pickle.load(f)
+        tl = cls(ticks_per_beat)
+        tl.ticks, tl.messages = ticks, messages
+        tl.total_ticks = ticks[-1] if ticks else 0
+        for abs_tick, msg in zip(ticks, messages):
+            if msg.type == 'set_tempo':
+                tl._add_tempo(abs_tick, msg.tempo)
+            elif msg.type == 'time_signature':
+                tl._add_meter(abs_tick, msg.numerator, msg.denominator)
+        tl.duration = duration
+        tl.first_bar_ticks = first_bar_ticks
+        tl.complete = True
+        return tl
+
+
+def compile_streaming(path, batch_size=512, on_complete=None):
+    """
+    Starts compiling `path` in a background thread. Blocks only until the
+    first bar is merged, then returns the (still growing) Timeline.
+    on_complete(timeline) runs on the compile thread once the file is done.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    _, ticks_per_beat, chunks = read_file_layout(data)
+    timeline = Timeline(ticks_per_beat)
+    first_bar_ready = threading.Event()
+
+    def compile_worker():
+        merged = heapq.merge(*(iter_track(data, start, size, i) for i, (start, size) in enumerate(chunks)),
+                             key=lambda ev: ev[0])
+        # First bar = one 4/4 bar until a time signature says otherwise
+        bar_ticks = ticks_per_beat * 4
+        last_tick = 0
+        end_tick = 0
+        batch = []
+        try:
+            for abs_tick, _, msg in merged:
+                # Single end_of_track at the very end (like mido.merge_tracks)
+                if msg.type == 'end_of_track':
+                    end_tick = max(end_tick, abs_tick)
+                    continue
+                delta = abs_tick - last_tick
+                last_tick = abs_tick
+                if msg.type == 'time_signature' and abs_tick == 0:
+                    bar_ticks = ticks_per_beat * msg.numerator * 4 // msg.denominator
+
+                msg.time = delta  # merged delta (the track-local one is no longer needed)
+                batch.append((abs_tick, msg))
+                if len(batch) >= batch_size or (not first_bar_ready.is_set() and abs_tick > bar_ticks):
+                    timeline.first_bar_ticks = bar_ticks
+                    timeline.extend(batch)
+                    batch = []
+                    if abs_tick > bar_ticks:
+                        first_bar_ready.set()
+
+            end_tick = max(end_tick, last_tick)
+            batch.append((end_tick, mido.MetaMessage('end_of_track', time=end_tick - last_tick)))
+        except Exception as e:
+            print(f"Timeline Error: {e}")
+            timeline.error = e
+        timeline.extend(batch, end=True)
+        first_bar_ready.set()
+        if on_complete is not None and timeline.error is None:
+            try:
+                on_complete(timeline)
+            except Exception as e:
+                print(f"Timeline Callback Error: {e}")
+
+    threading.Thread(target=compile_worker, daemon=True).start()
+    first_bar_ready.wait()
+    if timeline.error is not None and not timeline.messages[:-1]:
+        raise timeline.error
+    return timeline
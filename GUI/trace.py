@@ -1,10 +1,25 @@
 import asyncio
-import websockets
 import json
-import socket
-import numpy as np
+import sys
 import time
+from http import HTTPStatus
 import config
+import metrics
+
+# --- LAZY IMPORTS ---
+# trace.py runs as a long-lived service started with the app. The UDP control
+# port comes up first; numpy / websockets / the ring module load right after
+# in a worker thread (see load_modules), so commands are never stuck behind
+# interpreter warm-up.
+np = None
+websockets = None
+ringbuffer = None
+
+def load_modules():
+    global np, websockets, ringbuffer
+    import numpy as np
+    import websockets
+    import ringbuffer
 
 # --- STATE ---
 # State 0 = Calibration Mode (Adjustable)
@@ -12,9 +27,23 @@ import config
 app_state = 0 
 state_lock = asyncio.Lock()
 
-raw_wand_vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
-correction_matrix = np.identity(3, dtype=np.float32)
+raw_wand_vector = None      # set once numpy is loaded
+correction_matrix = None
 last_packet_time = 0
+hub_ring = None  # Our shared-memory ring (DATA, BEAT_TRIG, LOG), published by the hub process
+
+# --- SERVICE MODE ---
+# Active = streaming to connected browsers. Idle = sockets stay open, but no
+# frames are sent and the ring is not drained (no subscriber, no work either).
+active = None   # asyncio.Event, created in main()
+
+# --- METRICS ---
+ws_frames_sent = metrics.counter("trace_ws_frames_sent_total", "WebSocket frames pushed to the browser")
+trace_packets = metrics.counter("trace_packets_received_total", "UDP packets drained by the visualizer, by packet type")
+mode_switches = metrics.counter("trace_mode_switches_total", "ACTIVATE / DEACTIVATE commands applied, by mode")
+trace_active = metrics.gauge("trace_active", "1 while the visualizer streams, 0 while idle")
+delivery_latency = metrics.histogram("trace_delivery_latency_seconds",
+                                     "Hub serial read -> drained by the visualizer, by packet type (newest DATA / LOG per frame)")
 
 # --- MATH HELPER ---
 def get_rotation_matrix(vec1, vec2):
@@ -42,8 +71,7 @@ async def command_listener(websocket):
                 # 1. Start Fresh (When Wand Mode opens)
                 if message == "CMD_RESET_CALIB":
                     print("--- TRACE: Entering Calibration Mode ---")
-                    app_state = 0
-                    correction_matrix = np.identity(3) # Reset to raw
+                    reset_calibration() # Reset to raw
 
                 # 2. Recalibrate (Only allowed in State 0)
                 elif message == "CMD_RECALIBRATE":
@@ -62,46 +90,67 @@ async def command_listener(websocket):
         print(f"Listener Error: {e}")
 
 # --- TASK 2: STREAM DATA (Python -> Browser) ---
+def drain_ring(reader):
+    """
+    Reads everything new from the ring - numpy views straight out of shared
+    memory. Updates raw_wand_vector / last_packet_time and returns
+    (beat_detected, newest LOG line or None).
+    """
+    global raw_wand_vector, last_packet_time
+    beat_detected = False  # Flag to track if a beat happened in this frame
+    log_buffer = None # DEBUG Log buffer for Ardino stuff (used for weight detect debugging)
+    now = time.time()
+
+    for view in reader.poll():
+        kinds = view['kind']
+
+        # Check for Beat Trigger
+        beats = np.nonzero(kinds == ringbuffer.KIND_BEAT_TRIG)[0]
+        if len(beats):
+            beat_detected = True
+            trace_packets.inc(len(beats), type="BEAT_TRIG")
+            for rx in view['rx'][beats]:
+                delivery_latency.observe(now - float(rx), type="BEAT_TRIG")
+            metrics.log_event("trace", "beat_detected")
+
+        # Catch Log Messages (only the newest one matters for the overlay)
+        logs = np.nonzero(kinds == ringbuffer.KIND_LOG)[0]
+        if len(logs):
+            log_buffer = view['text'][logs[-1]].decode('utf-8', errors='ignore')
+            trace_packets.inc(len(logs), type="LOG")
+            delivery_latency.observe(now - float(view['rx'][logs[-1]]), type="LOG")
+            metrics.log_event("wand", "log", line=log_buffer)
+
+        # Check for Wand Data: keep the newest non-zero sample
+        data = view[kinds == ringbuffer.KIND_DATA]
+        if len(data):
+            trace_packets.inc(len(data), type="DATA")
+            delivery_latency.observe(now - float(data['rx'][-1]), type="DATA")
+            valid = np.nonzero(np.linalg.norm(data['val'], axis=1) > 0)[0]
+            if len(valid):
+                raw_wand_vector = data['val'][valid[-1]].copy()
+                last_packet_time = float(data['t'][valid[-1]])
+    return beat_detected, log_buffer
+
 async def data_streamer(websocket):
-    global raw_wand_vector, correction_matrix, app_state, last_packet_time
-    
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind((config.IP, config.PORT_VIS))
-    sock.setblocking(False)
+    reader = ringbuffer.RingReader(hub_ring)
 
     try:
         while True:
-            # 1. DRAIN UDP (Get latest data)
-            got_data = False
-            beat_detected = False  # Flag to track if a beat happened in this frame
-            log_buffer = None # DEBUG Log buffer for Ardino stuff (used for weight detect debugging)
-
-            # 1. DRAIN UDP
-            while True:
-                try:
-                    data, _ = sock.recvfrom(1024)
-                    line = data.decode('utf-8', errors='ignore').strip()
-                    
-                    # Check for Beat Trigger
-                    if line == "BEAT_TRIG":
-                        beat_detected = True
-                        print("--- Beat Detected! ---")
-
-                    # --- NEW: Catch Log Messages ---
-                    elif line.startswith("LOG:"):
-                        log_buffer = line 
-                        print(f"DEBUG: {line}")
-                    
-                    # Check for Wand Data
-                    elif line.startswith("DATA,"):
-                        parts = line.split(',')
-                        if len(parts) >= 4:
-                            vec = np.array([float(parts[1]), float(parts[2]), float(parts[3])], dtype=np.float32)
-                            if np.linalg.norm(vec) > 0:
-                                raw_wand_vector = vec
-                                last_packet_time = time.time()
-                except BlockingIOError: break
-                except Exception: break
+            # IDLE: one status frame, then sleep until the app activates us again
+            if not active.is_set():
+                aligned = np.dot(correction_matrix, raw_wand_vector)
+                await websocket.send(json.dumps({
+                    "x": float(-aligned[1]), "y": float(aligned[2]), "z": float(aligned[0]),
+                    "state": app_state, "msg": "VISUALIZER IDLE", "beat": False,
+                    "debug_log": None, "color": "#666666"
+                }))
+                await active.wait()
+                reader.skip()  # whatever piled up while idle is stale
+                continue
+
+            # 1. DRAIN RING (Get latest data)
+            beat_detected, log_buffer = drain_ring(reader)
 
             # 2. STATE LOGIC
             async with state_lock:
@@ -139,12 +188,11 @@ async def data_streamer(websocket):
                 }
             
             await websocket.send(json.dumps(packet))
+            ws_frames_sent.inc()
             await asyncio.sleep(0.016) # ~60 FPS
 
     except websockets.exceptions.ConnectionClosed:
         pass
-    finally:
-        sock.close()
 
 # --- MAIN HANDLER ---
 async def connection_handler(websocket):
@@ -158,9 +206,75 @@ async def connection_handler(websocket):
     )
     for task in pending: task.cancel()
 
+def serve_metrics(connection, request):
+    """ Plain HTTP GET /metrics on the WebSocket port (separate process from app.py) """
+    if request.path == "/metrics":
+        return connection.respond(HTTPStatus.OK, metrics.render())
+    return None
+
+# --- CONTROL PORT (app.py -> trace.py) ---
+def reset_calibration():
+    global app_state, correction_matrix
+    app_state = 0
+    correction_matrix = np.identity(3, dtype=np.float32)
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    """
+    VIS:ACTIVATE   - start streaming (fresh calibration, like a new window)
+    VIS:DEACTIVATE - go idle
+    VIS:PING       - liveness
+    Every command is answered with "VIS:ACK <command> <ready>" once applied.
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        cmd = data.decode('utf-8', errors='ignore').strip()
+        ready = int(np is not None and hub_ring is not None)
+        if cmd == "VIS:ACTIVATE":
+            if not active.is_set():
+                print("--- TRACE: Activated ---")
+                if ready:
+                    reset_calibration()
+                active.set()
+                mode_switches.inc(mode="activate")
+                trace_active.set(1)
+        elif cmd == "VIS:DEACTIVATE":
+            if active.is_set():
+                print("--- TRACE: Idle ---")
+                active.clear()
+                mode_switches.inc(mode="deactivate")
+                trace_active.set(0)
+        elif cmd != "VIS:PING":
+            return
+        self.transport.sendto(f"VIS:ACK {cmd[4:]} {ready}".encode('utf-8'), addr)
+
+def attach_ring():
+    """ Waits for app.py to create the ring, then attaches read-only """
+    while True:
+        try:
+            return ringbuffer.SampleRing.attach(config.VIS_RING_NAME, untrack=True)
+        except FileNotFoundError:
+            print("--- TRACE: Waiting for hub ring... ---")
+            time.sleep(0.5)
+
 async def main():
+    global hub_ring, active, raw_wand_vector
+    active = asyncio.Event()
+    # --active: spawned straight into streaming (the app found no running service)
+    if "--active" in sys.argv:
+        active.set()
+    trace_active.set(int(active.is_set()))
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(ControlProtocol, local_addr=(config.IP, config.PORT_VIS_CMD))
+
+    await loop.run_in_executor(None, load_modules)
+    raw_wand_vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    reset_calibration()
+    hub_ring = await loop.run_in_executor(None, attach_ring)
     print(f"--- TRACE: WebSocket Server running on port {config.WS_PORT} ---")
-    async with websockets.serve(connection_handler, "localhost", config.WS_PORT):
+    async with websockets.serve(connection_handler, "localhost", config.WS_PORT, process_request=serve_metrics):
         await asyncio.Future()
 
 if __name__ == "__main__":